@@ -10,7 +10,7 @@ import sys
 import humanize
 from gi.repository import GLib, GObject, Gio, Gtk, Notify
 
-from abeluna.sync import server
+from abeluna.sync import SMART_LISTS, server
 from abeluna.util import colour_text
 from abeluna.windows import SettingsWindow, TodoListWindow
 
@@ -34,6 +34,9 @@ class MainWindow(Gtk.ApplicationWindow):
         self.sync_todo_action = Gio.SimpleAction.new('sync-todo', None)
         self.sync_todo_action.connect('activate', lambda action, parameter: server.synchronize_todolist())
         self.add_action(self.sync_todo_action)
+        self.search_todo_action = Gio.SimpleAction.new('search-todo', None)
+        self.search_todo_action.connect('activate', lambda action, parameter: self.search_entry.grab_focus())
+        self.add_action(self.search_todo_action)
         self.general_settings_action = Gio.SimpleAction.new('general-settings', None)
         self.general_settings_action.connect(
             'activate',
@@ -55,6 +58,32 @@ class MainWindow(Gtk.ApplicationWindow):
         self.main_grid.set_border_width(10)
         self.add(self.main_grid)
 
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.set_placeholder_text('Search all tasks')
+        self.search_entry.connect('search-changed', self.search_changed)
+        self.search_entry.connect('activate', self.search_activated)
+        self.search_entry.connect('stop-search', self.search_stopped)
+        self.main_grid.attach(self.search_entry, 0, 0, 4, 1)
+
+        # Summary, calendar name, calendar UID, todo UID
+        self.search_store = Gtk.ListStore(str, str, str, str)
+        self.search_tree_view = Gtk.TreeView(model=self.search_store)
+        self.search_tree_view.append_column(Gtk.TreeViewColumn('Task', Gtk.CellRendererText(), text=0))
+        self.search_tree_view.append_column(Gtk.TreeViewColumn('Calendar', Gtk.CellRendererText(), text=1))
+        self.search_tree_view.connect('row-activated', self.search_result_activated)
+        self.search_tree_view.set_enable_search(False)
+
+        self.search_scrollable_view = Gtk.ScrolledWindow()
+        self.search_scrollable_view.set_min_content_height(300)
+        self.search_scrollable_view.set_propagate_natural_width(True)
+        self.search_scrollable_view.add(self.search_tree_view)
+
+        self.search_popover = Gtk.Popover()
+        self.search_popover.set_relative_to(self.search_entry)
+        self.search_popover.set_position(Gtk.PositionType.BOTTOM)
+        self.search_popover.set_modal(False)
+        self.search_popover.add(self.search_scrollable_view)
+
         self.calendar_store = Gtk.ListStore(str, str)
         self.calendar_uid_to_iter = {}
         self.calendar_tree_view = Gtk.TreeView(model=self.calendar_store)
@@ -69,7 +98,7 @@ class MainWindow(Gtk.ApplicationWindow):
         self.calendar_scrollable_view.set_shadow_type(type=Gtk.ShadowType.ETCHED_OUT)
         self.calendar_scrollable_view.add(self.calendar_tree_view)
 
-        self.main_grid.attach(self.calendar_scrollable_view, 0, 0, 4, 19)
+        self.main_grid.attach(self.calendar_scrollable_view, 0, 1, 4, 18)
 
         self.status_view = Gtk.Grid()
         self.status_view.set_column_spacing(5)
@@ -88,9 +117,7 @@ class MainWindow(Gtk.ApplicationWindow):
             self.status_view, self.calendar_scrollable_view, Gtk.PositionType.BOTTOM, 4, 1,
         )
 
-        self.main_grid.attach_next_to(
-            self.todolist_window, self.calendar_scrollable_view, Gtk.PositionType.RIGHT, 13, 20,
-        )
+        self.main_grid.attach(self.todolist_window, 4, 0, 13, 20)
 
         self.main_grid.show_all()
 
@@ -103,7 +130,7 @@ class MainWindow(Gtk.ApplicationWindow):
         if self._syncing:
             self.sync_spinner.start()
             return True
-        self.todolist_window.rebuild_todolist()
+        self.todolist_window.rebuild_todolist(reconcile=True)
         self.sync_spinner.stop()
         self.update_natural_dates()
         return False
@@ -121,10 +148,62 @@ class MainWindow(Gtk.ApplicationWindow):
             self.sync_label.set_label(' ')
             self.sync_label.set_tooltip_text('')
         else:
-            self.sync_label.set_label(colour_text('Last synced {}.'.format(humanize.naturaltime(last_sync)), '#666'))
-            self.sync_label.set_tooltip_text(last_sync.strftime('%c'))
+            label = colour_text('Last synced {}.'.format(humanize.naturaltime(last_sync)), '#666')
+            tooltip = [last_sync.strftime('%c')]
+            failed = []
+            for uid, status in server.sync_status.items():
+                try:
+                    name = server.calendars[uid].name
+                except KeyError:
+                    continue
+                if status.succeeded:
+                    tooltip.append('{}: synced in {:.1f}s'.format(name, status.duration))
+                else:
+                    failed.append(GLib.markup_escape_text(name))
+                    tooltip.append('{}: {}'.format(name, status.error))
+            if failed:
+                label += ' ' + colour_text('Failed to sync {}.'.format(', '.join(failed)), 'red')
+            self.sync_label.set_label(label)
+            self.sync_label.set_tooltip_text('\n'.join(tooltip))
         return True
 
+    def search_changed(self, search_entry):
+        self.search_store.clear()
+        text = search_entry.get_text()
+        for cal_uid, uid, summary in server.search_todos(text) if text.strip() else []:
+            try:
+                name = server.calendars[cal_uid].name
+            except KeyError:
+                continue
+            self.search_store.append([summary or '', name, cal_uid, uid])
+
+        if len(self.search_store):
+            self.search_popover.show_all()
+            self.search_popover.popup()
+        else:
+            self.search_popover.popdown()
+
+    def search_activated(self, search_entry):
+        if len(self.search_store):
+            self.show_search_result(self.search_store[0])
+
+    def search_stopped(self, search_entry):
+        search_entry.set_text('')
+        self.search_popover.popdown()
+
+    def search_result_activated(self, tree_view, path, column):
+        self.show_search_result(self.search_store[path])
+
+    def show_search_result(self, row):
+        cal_uid, uid = row[2], row[3]
+        self.search_popover.popdown()
+        try:
+            self.calendar_tree_view.get_selection().select_iter(self.calendar_uid_to_iter[cal_uid])
+        except KeyError:
+            return
+        self.todolist_window.select_todo(uid)
+        self.todolist_window.tree_view.grab_focus()
+
     def rebuild_calendarlist(self):
         path_iter = self.calendar_tree_view.get_selection().get_selected()[1]
         if path_iter is None:
@@ -134,6 +213,8 @@ class MainWindow(Gtk.ApplicationWindow):
         self.calendar_store.clear()
         self.calendar_uid_to_iter.clear()
 
+        for key, smart_list in SMART_LISTS.items():
+            self.calendar_uid_to_iter[key] = self.calendar_store.append([smart_list.name, key])
         for uid, calendar in server.calendars.items():
             self.calendar_uid_to_iter[uid] = self.calendar_store.append([calendar.name, uid])
 
@@ -154,8 +235,10 @@ class MainWindow(Gtk.ApplicationWindow):
             self.new_todo_action.set_enabled(False)
             self.todolist_window.current_calendar = None
         else:
-            self.new_todo_action.set_enabled(True)
-            self.todolist_window.current_calendar = self.calendar_store[path_iter][1]
+            uid = self.calendar_store[path_iter][1]
+            # Smart lists show todos of all calendars, so new todos could not be added to any of them.
+            self.new_todo_action.set_enabled(uid not in SMART_LISTS)
+            self.todolist_window.current_calendar = uid
 
 
 class Abeluna(Gtk.Application):
@@ -183,6 +266,7 @@ class Abeluna(Gtk.Application):
 
         self.add_accelerator('<Ctrl>N', 'win.new-todo', None)
         self.add_accelerator('<Ctrl>R', 'win.sync-todo', None)
+        self.add_accelerator('<Ctrl>F', 'win.search-todo', None)
         self.add_accelerator('<Ctrl>W', 'app.quit', None)
 
 
@@ -1,7 +1,9 @@
 import configparser
+import datetime
 import hashlib
 import os
 import threading
+from collections import namedtuple
 
 import pytz
 from gi.repository import GLib
@@ -12,6 +14,15 @@ def nonnegative_integer_validator(val):
         assert int(val) >= 0
     except (ValueError, AssertionError):
         return False
+    return True
+
+
+def positive_integer_validator(val):
+    try:
+        assert int(val) > 0
+    except (ValueError, AssertionError):
+        return False
+    return True
 
 
 class Settings:
@@ -19,20 +30,60 @@ class Settings:
         'TIMEZONE': 'UTC',
         'AUTOSYNC_INTERVAL': '600',  # seconds
         'SAVE_INTERVAL': '1',  # seconds
+        'SAVE_MAX_WAIT': '10',  # seconds
         'PRIORITIZE_ON_CONFLICT': 'SERVER',
         'HIDE_COMPLETED': '0',
         'ALL_DAY_DUE_TIME': '00:00',
+        'INCREMENTAL_SYNC': '1',
+        'SYNC_WORKERS': '4',
+        'SYNC_TIMEOUT': '60',  # seconds
+        'PARSE_WORKERS': '4',
+        'HTTP_POOL_SIZE': '10',
+        'HTTP_TIMEOUT': '60',  # seconds
+        'PUSH_WORKERS': '4',
+        'DB_CACHE_SIZE': '8192',  # KiB per connection
+        'DB_MMAP_SIZE': '64',  # MiB per connection
     }
     VALID_GENERAL_CONFIG_VALUES = {
-        'TIMEZONE': pytz.all_timezones,
+        'TIMEZONE': frozenset(pytz.all_timezones),
         'AUTOSYNC_INTERVAL': [
             '-1', '10', '30', '60', '600', '1800', '3600', '21600', '86400', '604800', '2419200', '1036800',
         ],
         'SAVE_INTERVAL': nonnegative_integer_validator,
+        'SAVE_MAX_WAIT': nonnegative_integer_validator,
         'PRIORITIZE_ON_CONFLICT': ['SERVER', 'CLIENT'],
         'HIDE_COMPLETED': ['0', '1'],
-        'ALL_DAY_DUE_TIME': ['{:02}:{:02}'.format(x, y) for x in range(24) for y in range(60)],
+        'ALL_DAY_DUE_TIME': frozenset('{:02}:{:02}'.format(x, y) for x in range(24) for y in range(60)),
+        'INCREMENTAL_SYNC': ['0', '1'],
+        'SYNC_WORKERS': positive_integer_validator,
+        'SYNC_TIMEOUT': positive_integer_validator,
+        'PARSE_WORKERS': positive_integer_validator,
+        'HTTP_POOL_SIZE': positive_integer_validator,
+        'HTTP_TIMEOUT': positive_integer_validator,
+        'PUSH_WORKERS': positive_integer_validator,
+        'DB_CACHE_SIZE': positive_integer_validator,
+        'DB_MMAP_SIZE': nonnegative_integer_validator,
+    }
+    # Converters from the validated strings to the values in Settings.general.
+    TYPED_GENERAL_CONFIG = {
+        'TIMEZONE': pytz.timezone,
+        'AUTOSYNC_INTERVAL': int,
+        'SAVE_INTERVAL': int,
+        'SAVE_MAX_WAIT': int,
+        'PRIORITIZE_ON_CONFLICT': str,
+        'HIDE_COMPLETED': int,
+        'ALL_DAY_DUE_TIME': lambda value: datetime.datetime.strptime(value, '%H:%M').time(),
+        'INCREMENTAL_SYNC': int,
+        'SYNC_WORKERS': int,
+        'SYNC_TIMEOUT': int,
+        'PARSE_WORKERS': int,
+        'HTTP_POOL_SIZE': int,
+        'HTTP_TIMEOUT': int,
+        'PUSH_WORKERS': int,
+        'DB_CACHE_SIZE': int,
+        'DB_MMAP_SIZE': int,
     }
+    GeneralConfig = namedtuple('GeneralConfig', list(DEFAULT_GENERAL_CONFIG))
 
     def __init__(self):
         self.TASK_STORAGE_LOCATION = os.path.join(GLib.get_user_data_dir(), 'abeluna', 'todolists')
@@ -44,6 +95,7 @@ class Settings:
 
         self.config = configparser.ConfigParser()
         self.config.read(self.CONFIG_FILE)
+        self._update_general_config()
 
         self.CALENDARS = {}
 
@@ -71,6 +123,30 @@ class Settings:
                 self.config[section_name].update(calendar)
             with open(self.CONFIG_FILE, 'w') as f:
                 self.config.write(f)
+            self._update_general_config()
+
+    def _update_general_config(self):
+        # The general settings are validated once whenever they change, rather than every time they are read.
+        # `general` holds the typed values, e.g. settings.general.TIMEZONE is a timezone.
+        with self._lock:
+            section = dict(self.config['General']) if self.config.has_section('General') else {}
+
+        values = {}
+        for field, default in self.DEFAULT_GENERAL_CONFIG.items():
+            value = section.get(self.config.optionxform(field), default)
+            iterable_or_callable = self.VALID_GENERAL_CONFIG_VALUES[field]
+            if callable(iterable_or_callable):
+                valid = iterable_or_callable(value)
+            else:
+                valid = value in iterable_or_callable
+            # if not valid:
+            #    print('Invalid setting "{}": {}'.format(field, value))
+            values[field] = value if valid else default
+
+        self._general_config = values
+        self.general = self.GeneralConfig(**{
+            field: self.TYPED_GENERAL_CONFIG[field](value) for field, value in values.items()
+        })
 
     def add_or_update_calendar(self, data):
         data.setdefault('local_storage', self.TASK_STORAGE_LOCATION)
@@ -84,12 +160,13 @@ class Settings:
                 # We're moving from a local todo list to a synced todo list, or vice versa
                 _old_data = self.CALENDARS[_old_uid]
                 if bool(_old_data['url']) ^ bool(data['url']):
+                    from abeluna.sync.local import LocalServer
+
                     filename = '{}.db'
+                    old_path = os.path.join(_old_data['local_storage'], filename.format(_old_uid))
+                    LocalServer.close_connections(old_path)
                     try:
-                        os.rename(
-                            os.path.join(_old_data['local_storage'], filename.format(_old_uid)),
-                            os.path.join(data['local_storage'], filename.format(_new_uid)),
-                        )
+                        os.rename(old_path, os.path.join(data['local_storage'], filename.format(_new_uid)))
                     except FileNotFoundError:
                         pass
                 self.CALENDARS.pop(_old_uid)
@@ -112,20 +189,7 @@ class Settings:
 
     def __getattr__(self, field):
         if field in self.DEFAULT_GENERAL_CONFIG:
-            with self._lock:
-                try:
-                    value = self.config['General'][field]
-                except KeyError:
-                    return self.DEFAULT_GENERAL_CONFIG[field]
-
-            iterable_or_callable = self.VALID_GENERAL_CONFIG_VALUES[field]
-            if callable(iterable_or_callable):
-                valid = iterable_or_callable(value)
-            else:
-                valid = value in iterable_or_callable
-            # if not valid:
-            #    print('Invalid setting "{}": {}'.format(field, value))
-            return value if valid else self.DEFAULT_GENERAL_CONFIG[field]
+            return self._general_config[field]
         raise AttributeError()
 
     def __setattr__(self, field, value):
@@ -134,6 +198,7 @@ class Settings:
                 if not self.config.has_section('General'):
                     self.config.add_section('General')
                 self.config['General'][field] = value
+            self._update_general_config()
         else:
             super().__setattr__(field, value)
 
@@ -1,3 +1,3 @@
 from abeluna.sync.calendar import Calendar
 from abeluna.sync.local import LocalServer
-from abeluna.sync.server import server
+from abeluna.sync.server import SMART_LISTS, server
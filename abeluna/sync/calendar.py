@@ -1,9 +1,55 @@
+import re
+import threading
+from urllib.parse import unquote, urlsplit
+
 import caldav
+from caldav.elements import dav
+from caldav.elements.base import ValuedBaseElement
+from caldav.lib.error import DAVError, DeleteError, NotFoundError, PutError
 
+from abeluna.settings import settings
 from abeluna.sync.local import LocalServer
 
 
+class GetCTag(ValuedBaseElement):
+    tag = '{http://calendarserver.org/ns/}getctag'
+
+
+class ClientRegistry:
+    # DAVClients are shared by the calendars of the same server and user, and kept when the calendars are refreshed,
+    # so their connections are kept alive and reused. A client is replaced when its settings change.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    def get(self, url, username, password):
+        parts = urlsplit(url)
+        key = (parts.scheme.lower(), parts.netloc.lower(), username)
+        options = (password, settings.general.HTTP_TIMEOUT, settings.general.HTTP_POOL_SIZE)
+        with self._lock:
+            try:
+                client_options, client = self._clients[key]
+            except KeyError:
+                pass
+            else:
+                if client_options == options:
+                    return client
+
+            client = caldav.DAVClient(url=url, username=username, password=password, timeout=options[1])
+            # Mounted for the origin, so it takes precedence over the adapters caldav mounted for every URL.
+            adapter = type(client.session.get_adapter(url))(pool_connections=1, pool_maxsize=options[2])
+            client.session.mount('{}://{}/'.format(parts.scheme, parts.netloc), adapter)
+            self._clients[key] = (options, client)
+            return client
+
+
+clients = ClientRegistry()
+
+
 class Calendar:
+    # Number of resources downloaded per calendar-multiget REPORT.
+    MULTIGET_SIZE = 100
+
     def __init__(self, uid, name, url, username, password, local_storage):
         self.uid = uid
         self.name = name
@@ -18,11 +64,7 @@ class Calendar:
             self.local_server = None
 
         if self.url:
-            self.client = caldav.DAVClient(
-                url=self.url,
-                username=self.username,
-                password=self.password,
-            )
+            self.client = clients.get(self.url, self.username, self.password)
             self.calendar = caldav.Calendar(client=self.client, url=self.url)
         else:
             self.client = self.calendar = None
@@ -43,6 +85,104 @@ class Calendar:
                 self._validated = response.status in (200, 207)
         return self._validated
 
+    def get_ctag(self):
+        try:
+            return self.calendar.get_property(GetCTag())
+        except DAVError:
+            return None
+
+    def sync_changes(self, sync_token=None, etags=None, expired=None):
+        # Returns the changed resources, the hrefs of deleted resources, the new sync token and whether every changed
+        # resource was downloaded (see load_todos).
+        # Without a sync token, every resource in the calendar is returned.
+        # Resources whose ETag matches the one in `etags` are returned without being downloaded.
+        if etags is None:
+            etags = {}
+        collection = self.calendar.objects_by_sync_token(sync_token=sync_token, load_objects=False)
+        new_sync_token = collection.sync_token
+        # Some versions of caldav silently fall back to listing the entire calendar with a fake token.
+        if not new_sync_token or str(new_sync_token).startswith('fake-'):
+            new_sync_token = None
+
+        unchanged, to_load = [], []
+        for remote_todo in collection.objects:
+            etag = self.etag(remote_todo)
+            if etag is not None and etags.get(str(remote_todo.url)) == etag:
+                unchanged.append(remote_todo)
+            else:
+                to_load.append(remote_todo)
+        changed, deleted_hrefs, complete = self.load_todos(to_load, expired=expired)
+        return unchanged + changed, deleted_hrefs, new_sync_token, complete
+
+    def load_todos(self, remote_todos, expired=None):
+        # Downloads the resources in batches, with one calendar-multiget REPORT each.
+        # Returns the loaded resources, the hrefs of the resources that no longer exist, and whether every resource was
+        # downloaded. No more batches are downloaded once `expired()` returns True.
+        loaded, deleted_hrefs = [], set()
+        for start in range(0, len(remote_todos), self.MULTIGET_SIZE):
+            if expired is not None and expired():
+                return loaded, deleted_hrefs, False
+            batch = remote_todos[start:start + self.MULTIGET_SIZE]
+            try:
+                results = self.calendar.multiget([remote_todo.url for remote_todo in batch])
+            except DAVError:
+                results = []
+            # Servers disagree on which characters of an href are escaped.
+            data = {unquote(str(result.url)): result.data for result in results}
+            for remote_todo in batch:
+                try:
+                    remote_todo.data = data[unquote(str(remote_todo.url))]
+                except KeyError:
+                    # Missing from the response, so only a request of its own tells whether it was deleted.
+                    try:
+                        remote_todo.load()
+                    except NotFoundError:
+                        deleted_hrefs.add(str(remote_todo.url))
+                        continue
+                loaded.append(remote_todo)
+        return loaded, deleted_hrefs, True
+
+    @staticmethod
+    def etag(remote_todo):
+        return remote_todo.props.get(dav.GetEtag.tag)
+
+    def save_todo(self, remote_todo, data, etag=None):
+        # Conditional PUT of the text of the calendar object, so that changes made by another client since we fetched
+        # the resource are not lost.
+        # Returns the new ETag if the server sent one, or False if the resource was changed in the meantime.
+        headers = {'Content-Type': 'text/calendar; charset=utf-8'}
+        if etag is not None:
+            headers['If-Match'] = etag
+        data = re.sub(r'\r?\n', '\r\n', data).encode()
+        response = self.client.put(str(remote_todo.url), data, headers)
+        if response.status == 412:
+            return False
+        if response.status not in (200, 201, 204):
+            raise PutError('Saving {} failed with status {}'.format(remote_todo.url, response.status))
+        return response.headers.get('ETag')
+
+    def delete_todo(self, remote_todo, etag=None):
+        # Conditional DELETE of the calendar object, for the same reason as save_todo.
+        # Returns False if the resource was changed in the meantime.
+        headers = {}
+        if etag is not None:
+            headers['If-Match'] = etag
+        response = self.client.request(str(remote_todo.url), 'DELETE', '', headers)
+        if response.status == 412:
+            return False
+        # Already deleted by another client is as good as deleted.
+        if response.status not in (200, 204, 404):
+            raise DeleteError('Deleting {} failed with status {}'.format(remote_todo.url, response.status))
+        return True
+
+    def todo_by_href(self, href, etag=None):
+        # The resource is not downloaded, see load_todos.
+        remote_todo = caldav.Todo(client=self.client, url=href, parent=self.calendar)
+        # Not every server sends the ETag along with the resource.
+        if etag is not None:
+            remote_todo.props.setdefault(dav.GetEtag.tag, etag)
+        return remote_todo
+
     def to_dict(self):
         return {
             'uid': self.uid,
@@ -1,113 +1,604 @@
+import datetime
+import hashlib
+import json
+import multiprocessing
 import os
 import sqlite3
-from collections import namedtuple
-from functools import partial
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from operator import itemgetter
 
 import icalendar
 
 
-class LocalTodo(namedtuple('LocalTodo', 'uid local_vtodo remote_vtodo')):
+def decode_todo_fields(component):
+    # Plain values of the properties of a todo, which are cheap to keep around and to send between processes.
+    def _decode(val):
+        if isinstance(val, list):
+            return [_decode(item) for item in val]
+        elif isinstance(val, icalendar.prop.vCategory):
+            return [str(cat) for cat in val.cats]
+        elif isinstance(val, icalendar.prop.vDDDTypes):
+            return val.dt
+        elif isinstance(val, int):
+            return int(val)
+        elif isinstance(val, str):
+            return str(val)
+        return val.to_ical().decode()
+
+    return {name: _decode(val) for name, val in component.items()}
+
+
+def _timestamp(value):
+    # Dates and floating times are taken as local times of the system, like the todo list and the smart lists do.
+    if value is None:
+        return None
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime(year=value.year, month=value.month, day=value.day)
+    return int(value.timestamp())
+
+
+def todo_sort_value(completed, status, completed_date, end_date, priority):
+    # Todos are listed by this value, descending. It only depends on the todo itself, never on the current time,
+    # so rows only move when they are edited. Dates are timestamps, compared as absolute minutes within their tier.
+    _GAP = 2**34
+    _MIN_BOUND = 0
+    _COMPLETED_BOUND = _GAP
+    _PRIORITY_BOUND = _GAP * 2
+    _END_DATE_BOUND = _GAP * 3
+
+    def _minutes(timestamp):
+        return min(max(timestamp // 60, 0), _GAP - 2)
+
+    if completed:
+        if completed_date is None:
+            return _MIN_BOUND
+        # Most recently completed first.
+        return _MIN_BOUND + 1 + _minutes(completed_date)
+    elif status == 'CANCELLED':
+        return _COMPLETED_BOUND + 1
+    elif status == 'IN-PROCESS':
+        return _PRIORITY_BOUND + 1
+    elif end_date is not None:
+        # Earliest due first.
+        return _END_DATE_BOUND + _GAP - 1 - _minutes(end_date)
+    elif priority:
+        return _PRIORITY_BOUND - priority
+    return _COMPLETED_BOUND + 2
+
+
+def todo_column_values(fields):
+    # Values of the property columns of the todo table (see LocalServer.PROPERTY_COLUMNS) for the decoded fields.
+    def _field(name, kind):
+        value = fields.get(name)
+        return value if isinstance(value, kind) else None
+
+    categories = fields.get('CATEGORIES')
+    if isinstance(categories, list):
+        categories = ' '.join(str(category) for category in categories)
+
+    status, percent_complete, priority = _field('STATUS', str), _field('PERCENT-COMPLETE', int), _field('PRIORITY', int)
+    due, completed = _timestamp(_field('DUE', datetime.date)), _timestamp(_field('COMPLETED', datetime.date))
+    return (
+        status,
+        percent_complete,
+        due,
+        _timestamp(_field('DTSTART', datetime.date)),
+        completed,
+        priority,
+        _field('RELATED-TO', str),
+        _timestamp(_field('LAST-MODIFIED', datetime.date)),
+        _field('SEQUENCE', int),
+        todo_sort_value(status == 'COMPLETED' and percent_complete == 100, status, completed, due, priority),
+        _field('SUMMARY', str),
+        _field('DESCRIPTION', str),
+        categories if isinstance(categories, str) else None,
+    )
+
+
+def search_query(text):
+    # FTS5 query matching todos that contain every word of the text, or words starting with it.
+    return ' '.join('"{}"*'.format(word.replace('"', '""')) for word in text.split())
+
+
+def parse_todo_fields(icals):
+    # Runs in the parser processes, so only the decoded fields are sent back.
+    return [decode_todo_fields(icalendar.Calendar.from_ical(ical)) for ical in icals]
+
+
+class ParsedTodoCache:
+    # Bounded LRU cache of parsed VTODOs, keyed by UID and a hash of their text, so unchanged todos are parsed once.
+    # Components are mutable, so callers always get a copy and the cached component is never handed out.
+    # It only has to hold the todos being worked on, e.g. the ones being edited, not every todo of every calendar.
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._fields = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _copy(cls, component):
+        # Property values are replaced rather than modified in place, so a shallow copy is enough.
+        copied = component.copy()
+        copied.subcomponents = [cls._copy(subcomponent) for subcomponent in component.subcomponents]
+        return copied
+
+    @staticmethod
+    def _key(uid, ical):
+        return (uid, hashlib.sha1(ical.encode()).digest())
+
+    def _get(self, cache, key):
+        with self._lock:
+            try:
+                value = cache[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            cache.move_to_end(key)
+            return value
+
+    def _add(self, cache, key, value):
+        with self._lock:
+            cache[key] = value
+            while len(cache) > self.maxsize:
+                cache.popitem(last=False)
+
+    def parse(self, uid, ical, cache=True):
+        # Components parsed once and thrown away, e.g. during a synchronization pass, are not added to the cache.
+        if ical is None:
+            return None
+
+        key = self._key(uid, ical)
+        component = self._get(self._cache, key)
+        if component is None:
+            component = icalendar.Calendar.from_ical(ical)
+            if not cache:
+                return component
+            self._add(self._cache, key, component)
+        return self._copy(component)
+
+    def fields(self, uid, ical):
+        # The decoded fields of a todo, or None if it was never parsed.
+        return self._get(self._fields, self._key(uid, ical))
+
+    def add_fields(self, uid, ical, fields):
+        self._add(self._fields, self._key(uid, ical), fields)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._fields.clear()
+            self.hits = self.misses = 0
+
+
+parsed_todo_cache = ParsedTodoCache()
+
+
+class LocalTodo(namedtuple('LocalTodo', 'uid local_ical remote_ical href etag')):
+    __slots__ = ()
+
+    # Todos are identified by their UID, the icalendar components themselves are mutable and unhashable.
     def __eq__(self, other):
-        if isinstance(other, str):
-            return self.uid == other
+        if not isinstance(other, LocalTodo):
+            return NotImplemented
         return self.uid == other.uid
 
+    def __ne__(self, other):
+        if not isinstance(other, LocalTodo):
+            return NotImplemented
+        return self.uid != other.uid
+
     def __hash__(self):
-        return self.uid
+        return hash(self.uid)
+
+    # Parsed on access, since most callers only need one of the two copies, if any. Each synchronization pass parses
+    # them at most once, so they are not kept in the cache.
+    @property
+    def local_vtodo(self):
+        return parsed_todo_cache.parse(self.uid, self.local_ical, cache=False)
+
+    @property
+    def remote_vtodo(self):
+        return parsed_todo_cache.parse(self.uid, self.remote_ical, cache=False)
+
+
+class TodoRecord(namedtuple('TodoRecord', 'uid ical fields')):
+    __slots__ = ()
+
+    # What the todo list needs to show a todo, the component itself is only parsed once it is edited.
+    @property
+    def vtodo(self):
+        return parsed_todo_cache.parse(self.uid, self.ical)
+
+
+def create_parse_pool(processes):
+    # The pool must be created before the application starts any thread, since forking a process with running threads
+    # can deadlock the child. Spawned processes are no alternative, they would import the application again and start
+    # another sync server.
+    processes = min(processes, os.cpu_count() or 1)
+    if processes <= 1:
+        return None
+    try:
+        executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('fork'))
+        # A pool using fork starts all of its processes on the first task, so they are forked now rather than later.
+        executor.submit(int).result()
+    except Exception:  # catch all
+        import traceback
+        traceback.print_exc()
+        return None
+    return executor
+
+
+def load_todo_records(todos, executor=None, chunk_size=500):
+    # Builds the records of (uid, ical) pairs, in order. Todos that were not parsed before are parsed in chunks,
+    # spread over the processes of the executor from create_parse_pool if there is more than one chunk.
+    fields = [parsed_todo_cache.fields(uid, ical) for uid, ical in todos]
+    missing = [index for index, item in enumerate(fields) if item is None]
+    chunks = [missing[start:start + chunk_size] for start in range(0, len(missing), chunk_size)]
+    icals = [[todos[index][1] for index in chunk] for chunk in chunks]
+
+    results = None
+    if executor is not None and len(chunks) > 1:
+        try:
+            results = list(executor.map(parse_todo_fields, icals))
+        except Exception:  # catch all
+            import traceback
+            traceback.print_exc()
+    if results is None:
+        results = map(parse_todo_fields, icals)
+
+    for chunk, chunk_fields in zip(chunks, results):
+        for index, item in zip(chunk, chunk_fields):
+            fields[index] = item
+            parsed_todo_cache.add_fields(*todos[index], item)
+    return [TodoRecord(uid, ical, item) for (uid, ical), item in zip(todos, fields)]
 
 
 class LocalServer:
+    TODO_COLUMNS = (
+        ('uid', 'TEXT PRIMARY KEY'),
+        ('local_vtodo', 'TEXT'),
+        ('remote_vtodo', 'TEXT'),
+        ('href', 'TEXT'),
+        ('etag', 'TEXT'),
+    )
+    # Copies of some properties of the local VTODO, so todos can be filtered and sorted without parsing them.
+    # Dates are stored as UNIX timestamps.
+    INDEXED_COLUMNS = (
+        ('status', 'TEXT'),
+        ('percent_complete', 'INTEGER'),
+        ('due', 'INTEGER'),
+        ('start', 'INTEGER'),
+        ('completed', 'INTEGER'),
+        ('priority', 'INTEGER'),
+        ('related_to', 'TEXT'),
+        ('last_modified', 'INTEGER'),
+        ('sequence', 'INTEGER'),
+        ('sort_value', 'INTEGER'),
+    )
+    # Text of the todos, indexed for full-text search by the todo_search table.
+    SEARCH_COLUMNS = (
+        ('summary', 'TEXT'),
+        ('description', 'TEXT'),
+        ('categories', 'TEXT'),
+    )
+    PROPERTY_COLUMNS = INDEXED_COLUMNS + SEARCH_COLUMNS
+    # Weights of the search columns when ranking search results.
+    SEARCH_WEIGHTS = (10.0, 1.0, 5.0)
+    # Incremented whenever the property columns of existing databases must be filled in again.
+    SCHEMA_VERSION = 4
+    # Order of the todos in the todo list, see todo_sort_value. The after and until keys of query_todos are the
+    # (sort_value, rowid) of a todo in this order.
+    LIST_ORDER = 'todo.sort_value DESC, todo.rowid DESC'
+    # Set by the sync server to the pool of create_parse_pool while the databases of older versions are upgraded,
+    # which fills in their property columns. Otherwise they are filled in by the current process.
+    parse_pool = None
+
+    # Connections are kept open for the lifetime of the application, one per database per thread.
+    _connections = {}
+    _connections_lock = threading.Lock()
+
     def __init__(self, path, calendar_name):
         self.path = path
         self.calendar = calendar_name
-        self.conn = partial(sqlite3.connect, os.path.join(self.path, '{}.db'.format(self.calendar)))
+        self.db_path = os.path.join(self.path, '{}.db'.format(self.calendar))
 
         with self.conn() as c:
             c.execute('''
                 CREATE TABLE IF NOT EXISTS todo
-                (uid TEXT PRIMARY KEY, local_vtodo TEXT, remote_vtodo TEXT)
+                ({columns})
+            '''.format(columns=', '.join('{} {}'.format(*column) for column in self.TODO_COLUMNS)))
+            # Databases created by older versions are missing some columns.
+            existing_columns = {row[1] for row in c.execute('PRAGMA table_info(todo)')}
+            for name, definition in self.TODO_COLUMNS + self.PROPERTY_COLUMNS:
+                if name not in existing_columns:
+                    c.execute('ALTER TABLE todo ADD COLUMN {} {}'.format(name, definition))
+            for name, _ in self.INDEXED_COLUMNS:
+                c.execute('CREATE INDEX IF NOT EXISTS todo_{name} ON todo ({name})'.format(name=name))
+            # The search index reads the text from the todo table, and is kept up to date by triggers.
+            c.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS todo_search
+                USING fts5({columns}, content='todo', content_rowid='rowid')
+            '''.format(columns=', '.join(name for name, _ in self.SEARCH_COLUMNS)))
+            if c.execute('PRAGMA user_version').fetchone()[0] < self.SCHEMA_VERSION:
+                self._fill_property_columns(c)
+                c.execute("INSERT INTO todo_search (todo_search) VALUES ('rebuild')")
+                c.execute('PRAGMA user_version = {}'.format(self.SCHEMA_VERSION))
+            self._create_search_triggers(c)
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS sync_state
+                (key TEXT PRIMARY KEY, value TEXT)
             ''')
             c.commit()
 
         self.todolist = []
 
+    @classmethod
+    def needs_upgrade(cls, path, calendar_name):
+        # Whether the database exists and its property columns will be filled in again once it is opened.
+        db_path = os.path.join(path, '{}.db'.format(calendar_name))
+        if not os.path.exists(db_path):
+            return False
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute('PRAGMA user_version').fetchone()[0] < cls.SCHEMA_VERSION
+        finally:
+            conn.close()
+
+    @classmethod
+    def _set_property_columns(cls):
+        return ', '.join('{}=?'.format(name) for name, _ in cls.PROPERTY_COLUMNS)
+
+    def _fill_property_columns(self, c):
+        todos = c.execute('SELECT uid, local_vtodo FROM todo WHERE local_vtodo IS NOT NULL').fetchall()
+        c.executemany(
+            'UPDATE todo SET {} WHERE uid = ?'.format(self._set_property_columns()),
+            [
+                todo_column_values(record.fields) + (record.uid,)
+                for record in load_todo_records(todos, executor=self.parse_pool)
+            ],
+        )
+
+    def _create_search_triggers(self, c):
+        names = [name for name, _ in self.SEARCH_COLUMNS]
+        values = {
+            'columns': ', '.join(names),
+            'new': ', '.join('new.{}'.format(name) for name in names),
+            'old': ', '.join('old.{}'.format(name) for name in names),
+        }
+        insert = 'INSERT INTO todo_search (rowid, {columns}) VALUES (new.rowid, {new});'.format(**values)
+        delete = (
+            "INSERT INTO todo_search (todo_search, rowid, {columns}) VALUES ('delete', old.rowid, {old});"
+        ).format(**values)
+        for name, event, statements in (
+            ('todo_search_insert', 'AFTER INSERT', insert),
+            ('todo_search_delete', 'AFTER DELETE', delete),
+            ('todo_search_update', 'AFTER UPDATE OF {}'.format(values['columns']), delete + insert),
+        ):
+            c.execute('CREATE TRIGGER IF NOT EXISTS {} {} ON todo BEGIN {} END'.format(name, event, statements))
+
+    def conn(self):
+        key = (self.db_path, threading.get_ident())
+        with self._connections_lock:
+            try:
+                return self._connections[key]
+            except KeyError:
+                pass
+
+            # Thread identifiers can be reused, so only connections of dead threads are dropped.
+            alive = {thread.ident for thread in threading.enumerate()}
+            for dead_key in [k for k in self._connections if k[1] not in alive]:
+                self._connections.pop(dead_key).close()
+
+            from abeluna.settings import settings
+
+            conn = self._connections[key] = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            # A negative cache size is in KiB rather than in pages.
+            conn.execute('PRAGMA cache_size=-{}'.format(settings.general.DB_CACHE_SIZE))
+            conn.execute('PRAGMA mmap_size={}'.format(settings.general.DB_MMAP_SIZE * 1024 * 1024))
+            return conn
+
+    @classmethod
+    def close_connections(cls, db_path):
+        # Must be called before the database file is moved, otherwise the write-ahead log is left behind.
+        with cls._connections_lock:
+            for key in [k for k in cls._connections if k[0] == db_path]:
+                cls._connections.pop(key).close()
+
     def _sanitize_uid(self, uid):
         return str(uid)
 
     def todos(self, include_deleted=False):
-        def create_ical(val):
-            if val is None:
-                return val
-            return icalendar.Calendar.from_ical(val)
-
         with self.conn() as c:
             data = c.execute(
                 '''
-                SELECT * FROM todo
+                SELECT uid, local_vtodo, remote_vtodo, href, etag FROM todo
                 {where}
                 '''.format(where='' if include_deleted else 'WHERE local_vtodo IS NOT NULL'),
             ).fetchall()
 
-        return [
-            LocalTodo(
-                uid=item[0],
-                local_vtodo=create_ical(item[1]),
-                remote_vtodo=create_ical(item[2]),
-            ) for item in data
-        ]
+        return [LocalTodo(*item) for item in data]
+
+    @staticmethod
+    def _filter_todos(
+        status=None, exclude_status=None, exclude_completed=False, due_before=None, due_after=None,
+        completed_after=None, modified_after=None,
+    ):
+        # Condition on the todos of {table} that were not deleted locally and match the filters, and its named
+        # parameters. Dates are datetimes, todos without the date are left out when filtering on it.
+        conditions = ['{table}.local_vtodo IS NOT NULL']
+        parameters = {}
+
+        def _add(condition, **values):
+            conditions.append(condition)
+            parameters.update(values)
+
+        def _list(name, values):
+            names = ['{}{}'.format(name, index) for index in range(len(values))]
+            parameters.update(zip(names, values))
+            return ', '.join(':' + name for name in names)
+
+        if status is not None:
+            _add('{{table}}.status IN ({})'.format(_list('status', status)))
+        if exclude_status is not None:
+            _add('{{table}}.status IS NULL OR {{table}}.status NOT IN ({})'.format(
+                _list('exclude_status', exclude_status),
+            ))
+        if exclude_completed:
+            _add("NOT ({table}.status IS 'COMPLETED' AND {table}.percent_complete IS 100)")
+        if due_before is not None:
+            _add('{table}.due < :due_before', due_before=_timestamp(due_before))
+        if due_after is not None:
+            _add('{table}.due >= :due_after', due_after=_timestamp(due_after))
+        if completed_after is not None:
+            _add('{table}.completed >= :completed_after', completed_after=_timestamp(completed_after))
+        if modified_after is not None:
+            _add('{table}.last_modified >= :modified_after', modified_after=_timestamp(modified_after))
+        return ' AND '.join('({})'.format(condition) for condition in conditions), parameters
+
+    def query_todos(
+        self, columns=('uid', 'local_vtodo'), uids=None, related_to=None, top_level=False, after=None, until=None,
+        order_by=None, limit=None, **filters,
+    ):
+        # Rows of the given columns of the todos that match the filters of _filter_todos, optionally only the todos
+        # with the given UIDs, the children of the given UIDs, the todos at the top level, or the todos after or up to
+        # a key in LIST_ORDER. A todo is a child of its
+        # RELATED-TO todo if that todo matches the filters too, unless it is the first (lowest UID) of a cycle of todos
+        # that are each other's parents, which is at the top level instead. Besides the columns of the todo table,
+        # the columns can be has_children, and parent, which is the todo it is a child of.
+        matches, parameters = self._filter_todos(**filters)
+
+        def _is_cycle_start(table):
+            return '''
+                {table}.uid = (
+                    WITH RECURSIVE ancestor(uid) AS (
+                        SELECT {table}.related_to
+                        UNION
+                        SELECT todo_ancestor.related_to FROM todo AS todo_ancestor
+                        JOIN ancestor ON todo_ancestor.uid = ancestor.uid
+                        WHERE {ancestor_matches}
+                    )
+                    SELECT MIN(uid) FROM ancestor
+                )
+            '''.format(table=table, ancestor_matches=matches.format(table='todo_ancestor'))
+
+        is_child = '''
+            EXISTS (
+                SELECT 1 FROM todo AS todo_parent
+                WHERE todo_parent.uid = todo.related_to AND {parent_matches}
+            ) AND NOT {is_cycle_start}
+        '''.format(parent_matches=matches.format(table='todo_parent'), is_cycle_start=_is_cycle_start('todo'))
+        computed_columns = {
+            'has_children': '''
+                EXISTS (
+                    SELECT 1 FROM todo AS todo_child
+                    WHERE todo_child.related_to = todo.uid AND {child_matches} AND NOT {is_cycle_start}
+                )
+            '''.format(child_matches=matches.format(table='todo_child'), is_cycle_start=_is_cycle_start('todo_child')),
+            'parent': 'CASE WHEN {} THEN todo.related_to END'.format(is_child),
+        }
+
+        conditions = [matches.format(table='todo')]
+        if uids is not None:
+            conditions.append('todo.uid IN (SELECT value FROM json_each(:uids))')
+            parameters['uids'] = json.dumps(list(uids))
+        if related_to is not None:
+            conditions.append('todo.related_to IN (SELECT value FROM json_each(:related_to)) AND {}'.format(is_child))
+            parameters['related_to'] = json.dumps(list(related_to))
+        if top_level:
+            conditions.append('NOT ({})'.format(is_child))
+        if after is not None:
+            conditions.append('(todo.sort_value, todo.rowid) < (:after_sort_value, :after_rowid)')
+            parameters['after_sort_value'], parameters['after_rowid'] = after
+        if until is not None:
+            conditions.append('(todo.sort_value, todo.rowid) >= (:until_sort_value, :until_rowid)')
+            parameters['until_sort_value'], parameters['until_rowid'] = until
+
+        query = 'SELECT {columns} FROM todo WHERE {where}'.format(
+            columns=', '.join(computed_columns.get(column, 'todo.' + column) for column in columns),
+            where=' AND '.join('({})'.format(condition) for condition in conditions),
+        )
+        if order_by is not None:
+            query += ' ORDER BY {}'.format(order_by)
+        if limit is not None:
+            query += ' LIMIT :limit'
+            parameters['limit'] = limit
 
-    def update_todo_from_server(self, vtodo):
-        ical = vtodo.to_ical().decode()
-        uid = self._sanitize_uid(vtodo['UID'])
         with self.conn() as c:
-            c.execute(
+            return c.execute(query, parameters).fetchall()
+
+    def search_todos(self, text, limit=50):
+        # (uid, summary, rank) of the todos matching the text, best match first. Lower ranks are better.
+        query = search_query(text)
+        if not query:
+            return []
+        with self.conn() as c:
+            return c.execute(
                 '''
-                INSERT OR IGNORE INTO todo
-                VALUES (?, NULL, NULL)
-                ''',
-                (uid,),
-            )
-            c.execute(
+                SELECT todo.uid, todo.summary, bm25(todo_search, {weights}) AS search_rank
+                FROM todo_search JOIN todo ON todo.rowid = todo_search.rowid
+                WHERE todo_search MATCH ? AND todo.local_vtodo IS NOT NULL
+                ORDER BY search_rank
+                LIMIT ?
+                '''.format(weights=', '.join(map(str, self.SEARCH_WEIGHTS))),
+                (query, limit),
+            ).fetchall()
+
+    def local_changes(self):
+        # UIDs of todos that were created, modified or deleted locally since the last synchronization.
+        with self.conn() as c:
+            data = c.execute(
                 '''
-                UPDATE todo
-                SET local_vtodo=?, remote_vtodo=?
-                WHERE uid=?
+                SELECT uid FROM todo
+                WHERE local_vtodo IS NOT remote_vtodo
                 ''',
-                (ical, ical, uid),
-            )
-            c.commit()
+            ).fetchall()
+        return {item[0] for item in data}
+
+    def sync_state(self):
+        with self.conn() as c:
+            data = dict(c.execute('SELECT key, value FROM sync_state').fetchall())
+        return data.get('ctag'), data.get('sync_token')
+
+    def update_sync_state(self, ctag, sync_token):
+        with self.batch() as batch:
+            batch.update_sync_state(ctag, sync_token)
+
+    def batch(self):
+        return LocalBatch(self)
+
+    def update_todo_from_server(self, vtodo, href=None, etag=None):
+        with self.batch() as batch:
+            batch.update_todo_from_server(vtodo, href=href, etag=etag)
 
     def update_todo_from_client(self, vtodo):  # also includes creating the todo
         ical = vtodo.to_ical().decode()
         uid = self._sanitize_uid(vtodo['UID'])
+        fields = decode_todo_fields(vtodo)
+        parsed_todo_cache.add_fields(uid, ical, fields)
         with self.conn() as c:
             c.execute(
                 '''
-                INSERT OR IGNORE INTO todo
-                VALUES (?, NULL, NULL)
-                ''',
-                (uid,),
-            )
-            c.execute(
-                '''
-                UPDATE todo
-                SET local_vtodo=?
-                WHERE uid=?
-                ''',
-                (ical, uid),
+                INSERT INTO todo (uid, local_vtodo, {columns})
+                VALUES (?, ?, {placeholders})
+                ON CONFLICT (uid) DO UPDATE
+                SET local_vtodo=excluded.local_vtodo, {update}
+                '''.format(**LocalBatch.PROPERTY_COLUMNS_SQL),
+                (uid, ical) + todo_column_values(fields),
             )
             c.commit()
+        return TodoRecord(uid, ical, fields)
 
     def delete_todo_from_server(self, vtodo):
-        with self.conn() as c:
-            c.execute(
-                '''
-                DELETE FROM todo
-                WHERE uid = ?
-                ''',
-                (self._sanitize_uid(vtodo['UID']),),
-            )
-            c.commit()
+        with self.batch() as batch:
+            batch.delete_todo_from_server(vtodo)
 
     def delete_todo_from_client(self, vtodo):
         uid = self._sanitize_uid(vtodo['UID'])
@@ -122,9 +613,71 @@ class LocalServer:
             c.execute(
                 '''
                 UPDATE todo
-                SET local_vtodo = NULL
+                SET local_vtodo = NULL, {}
                 WHERE uid = ? and remote_vtodo IS NOT NULL
-                ''',
-                (uid,),
+                '''.format(self._set_property_columns()),
+                (None,) * len(self.PROPERTY_COLUMNS) + (uid,),
             )
             c.commit()
+
+
+class LocalBatch:
+    # Collects the writes of a synchronization pass and commits them in a single transaction.
+    # The writes mirror changes that already happened on the server, so they are committed even if the block raises.
+    PROPERTY_COLUMNS_SQL = {
+        'columns': ', '.join(name for name, _ in LocalServer.PROPERTY_COLUMNS),
+        'placeholders': ', '.join('?' * len(LocalServer.PROPERTY_COLUMNS)),
+        'update': ', '.join('{0}=excluded.{0}'.format(name) for name, _ in LocalServer.PROPERTY_COLUMNS),
+    }
+    UPDATE_FROM_SERVER = '''
+        INSERT INTO todo (uid, local_vtodo, remote_vtodo, href, etag, {columns})
+        VALUES (?, ?, ?, ?, ?, {placeholders})
+        ON CONFLICT (uid) DO UPDATE
+        SET local_vtodo=excluded.local_vtodo, remote_vtodo=excluded.remote_vtodo,
+            href=COALESCE(excluded.href, href), etag=excluded.etag, {update}
+    '''.format(**PROPERTY_COLUMNS_SQL)
+    DELETE_FROM_SERVER = '''
+        DELETE FROM todo
+        WHERE uid = ?
+    '''
+    UPDATE_SYNC_STATE = '''
+        INSERT OR REPLACE INTO sync_state
+        VALUES (?, ?)
+    '''
+
+    def __init__(self, local_server):
+        self.local_server = local_server
+        self.operations = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.commit()
+
+    def update_todo_from_server(self, vtodo, href=None, etag=None):
+        ical = vtodo.to_ical().decode()
+        uid = self.local_server._sanitize_uid(vtodo['UID'])
+        fields = decode_todo_fields(vtodo)
+        parsed_todo_cache.add_fields(uid, ical, fields)
+        self.operations.append((
+            self.UPDATE_FROM_SERVER,
+            (uid, ical, ical, href, etag) + todo_column_values(fields),
+        ))
+
+    def delete_todo_from_server(self, vtodo):
+        self.operations.append((self.DELETE_FROM_SERVER, (self.local_server._sanitize_uid(vtodo['UID']),)))
+
+    def update_sync_state(self, ctag, sync_token):
+        self.operations.append((self.UPDATE_SYNC_STATE, ('ctag', ctag)))
+        self.operations.append((self.UPDATE_SYNC_STATE, ('sync_token', sync_token)))
+
+    def commit(self):
+        if not self.operations:
+            return
+        with self.local_server.conn() as c:
+            # Consecutive operations of the same kind are sent together, keeping the order of everything else.
+            for statement, operations in groupby(self.operations, key=itemgetter(0)):
+                c.executemany(statement, [parameters for _, parameters in operations])
+            c.commit()
+        self.operations = []
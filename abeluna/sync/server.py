@@ -1,17 +1,22 @@
 import datetime
-import queue
+import heapq
+import itertools
+import re
 import threading
 import time
 import uuid
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 
 import caldav
 import icalendar
+from caldav.lib.error import DAVError
 
 from abeluna.settings import settings
 from abeluna.sync.calendar import Calendar
-from abeluna.util import generate_vtimezone
+from abeluna.sync.local import LocalServer, create_parse_pool
+from abeluna.util import timezones
 
 
 class Task:
@@ -39,34 +44,175 @@ class Task:
         self._progress = 100 if value else 0
 
 
+SyncStatus = namedtuple('SyncStatus', 'succeeded duration error')
+PendingSave = namedtuple('PendingSave', 'vtodo cal_uid first_change last_change')
+SmartList = namedtuple('SmartList', 'name filters')
+
+# Lists of the unfinished todos of all calendars, shown along with the calendars. The filters of LocalServer.query_todos
+# are computed from the start of the current day. Todos are split by the day they are due, so a todo that is due later
+# today, or on a date without a time, is only in Today.
+SMART_LISTS = {
+    'smart-list-overdue': SmartList('Overdue', lambda today: {'due_before': today}),
+    'smart-list-today': SmartList(
+        'Today', lambda today: {'due_after': today, 'due_before': today + datetime.timedelta(days=1)},
+    ),
+    'smart-list-upcoming': SmartList(
+        'Upcoming',
+        lambda today: {
+            'due_after': today + datetime.timedelta(days=1),
+            'due_before': today + datetime.timedelta(days=8),
+        },
+    ),
+}
+
+
+_COMPONENT_LINE = re.compile(r'^(BEGIN|END):([^\r\n]*)(?:\r?\n|\Z)', re.MULTILINE | re.IGNORECASE)
+
+
+def split_calendar(data):
+    # Splits the text of a calendar object without parsing it. Each component of the calendar, e.g. a VTODO or a
+    # VTIMEZONE, is a (name, text) pair, and the text around them is a (None, text) pair. Joining all the texts
+    # gives back the calendar object.
+    pieces = []
+    depth = 0
+    start = end = 0
+    for match in _COMPONENT_LINE.finditer(data):
+        if match.group(1).upper() == 'BEGIN':
+            depth += 1
+            if depth == 2:
+                pieces.append((None, data[end:match.start()]))
+                start, name = match.start(), match.group(2).strip().upper()
+        else:
+            depth -= 1
+            if depth < 0:
+                raise ValueError('Unexpected END:{} in calendar object.'.format(match.group(2).strip()))
+            if depth == 1:
+                end = match.end()
+                pieces.append((name, data[start:end]))
+    if depth != 0:
+        raise ValueError('Calendar object is missing END lines.')
+    pieces.append((None, data[end:]))
+    return [piece for piece in pieces if piece[1]]
+
+
+def parse_todo(text, vtimezones=()):
+    # Parses the text of a VTODO from split_calendar. Its TZIDs can be defined only by the VTIMEZONEs of its calendar
+    # object, e.g. non-Olson names, so these are parsed along with it, otherwise its dates would come back naive.
+    if 'TZID' not in text.upper():
+        return icalendar.Todo.from_ical(text)
+    vcal = icalendar.Calendar.from_ical('BEGIN:VCALENDAR\r\n{}{}END:VCALENDAR\r\n'.format(''.join(vtimezones), text))
+    return vcal.walk('VTODO')[0]
+
+
+class TaskScheduler:
+    # Runs tasks at their deadline. Waiting threads sleep until the earliest deadline, or until a task is scheduled.
+    def __init__(self, timefunc):
+        self.timefunc = timefunc
+        self._heap = []
+        self._entries = {}  # task UID -> entry
+        self._keys = {}  # coalescing key -> task UID
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    def schedule(self, deadline, method, task, args, kwargs, key=None):
+        # A task scheduled with the same key as a pending task replaces it.
+        entry = [deadline, next(self._counter), method, task, args, kwargs, key]
+        with self._condition:
+            self._cancel(task.uid)
+            if key is not None:
+                if key in self._keys:
+                    self._cancel(self._keys[key])
+                self._keys[key] = task.uid
+            self._entries[task.uid] = entry
+            heapq.heappush(self._heap, entry)
+            self._condition.notify()
+
+    def _cancel(self, task_uid):
+        entry = self._entries.pop(task_uid, None)
+        if entry is None:
+            return False
+        if entry[6] is not None and self._keys.get(entry[6]) == task_uid:
+            del self._keys[entry[6]]
+        # Removing from the middle of the heap is expensive, so cancelled entries are skipped when they come up.
+        entry[2] = None
+        return True
+
+    def cancel(self, task):
+        with self._condition:
+            return self._cancel(task.uid)
+
+    def cancel_key(self, key):
+        with self._condition:
+            try:
+                return self._cancel(self._keys[key])
+            except KeyError:
+                return False
+
+    def pending(self):
+        with self._condition:
+            return len(self._entries)
+
+    def next(self):
+        # Blocks until a task is due and returns it, or returns None once the scheduler is stopped.
+        with self._condition:
+            while not self._stopped:
+                while self._heap and self._heap[0][2] is None:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                timeout = self._heap[0][0] - self.timefunc()
+                if timeout > 0:
+                    self._condition.wait(timeout=timeout)
+                    continue
+                deadline, _, method, task, args, kwargs, key = heapq.heappop(self._heap)
+                self._cancel(task.uid)
+                return method, task, args, kwargs
+            return None
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+
 def background_task(method):
     @wraps(method)
     def wrapper(self, *args, **kwargs):
-        try:
-            task = kwargs.pop('task', Task())
-            delay_abs = kwargs.pop('delay', -1) + self.timefunc()
-            self.task_queue.put_nowait((delay_abs, method, task, (self, task) + args, kwargs))
-        except queue.Full:
-            return None
-        else:
-            return task
+        task = kwargs.pop('task', Task())
+        deadline = kwargs.pop('delay', -1) + self.timefunc()
+        key = kwargs.pop('coalesce_key', None)
+        self.scheduler.schedule(deadline, method, task, (self, task) + args, kwargs, key=key)
+        return task
     return wrapper
 
 
 class SynchronizationServer:
-    def __init__(self):
-        self.task_queue = queue.PriorityQueue()
+    # Failed uploads of todos created locally are retried, waiting PUSH_BACKOFF seconds, then twice as long each time.
+    PUSH_RETRIES = 3
+    PUSH_BACKOFF = 1
 
-        self.todolist = defaultdict(list)
+    def __init__(self):
+        # The parser processes are only needed to upgrade the databases of older versions, which happens once the
+        # calendars are refreshed. They must be started before any thread is, see create_parse_pool.
+        self._parse_pool = None
+        if any(
+            LocalServer.needs_upgrade(cal_dict['local_storage'], uid)
+            for uid, cal_dict in settings.ordered_calendars.items() if cal_dict.get('local_storage')
+        ):
+            self._parse_pool = create_parse_pool(settings.general.PARSE_WORKERS)
+        LocalServer.parse_pool = self._parse_pool
+
+        self.timefunc = time.monotonic
+        self.scheduler = TaskScheduler(self.timefunc)
 
         self._stop_lock = threading.RLock()
 
-        self._worker_stop = threading.Event()
         self._worker_thread = threading.Thread(target=self.worker_run)
         self._worker_thread.start()
         self._general_lock = threading.RLock()
-        self._update_todo_skip = {}
-        self.timefunc = time.time
+        self._pending_saves = {}
 
         self._autosync_stop = threading.Event()
         self._autosync_thread = None
@@ -74,39 +220,47 @@ class SynchronizationServer:
         self.last_sync = None
         self._sync_lock = threading.RLock()
         self._sync_callbacks = []
+        self.sync_status = {}
+        # Kept for the lifetime of the application, so the sync threads keep their database connections.
+        self._sync_executor = ThreadPoolExecutor(max_workers=settings.general.SYNC_WORKERS)
 
         self.calendars = {}
 
     def stop_all(self):
         with self._stop_lock:
-            self._worker_stop.set()
+            self.scheduler.stop()
             self._autosync_stop.set()
         self._worker_thread.join()
         self._autosync_thread.join()
+        self.flush_pending_saves()
+        self._sync_executor.shutdown()
+        self._shutdown_parse_pool()
+
+    def _shutdown_parse_pool(self):
+        parse_pool, self._parse_pool = self._parse_pool, None
+        LocalServer.parse_pool = None
+        if parse_pool is not None:
+            parse_pool.shutdown()
+
+    def cancel_task(self, task):
+        return self.scheduler.cancel(task)
 
     def worker_run(self):
-        timeout = 0
-        while not self._worker_stop.wait(timeout=timeout):
+        while True:
+            scheduled = self.scheduler.next()
+            if scheduled is None:
+                break
+            method, task, args, kwargs = scheduled
             try:
-                delay_abs, method, task, args, kwargs = self.task_queue.get_nowait()
-                if delay_abs > self.timefunc():
-                    self.task_queue.put_nowait((delay_abs, method, task, args, kwargs))
-                    raise queue.Empty()
-            except queue.Empty:
-                timeout = 0.25
-            else:
-                timeout = 0
-                try:
-                    task.completed = method(*args, **kwargs)
-                except KeyboardInterrupt:
-                    break
-                except Exception:  # catch all
-                    task.completed = False
-                    import traceback
-                    traceback.print_exc()
+                task.completed = method(*args, **kwargs)
+            except KeyboardInterrupt:
+                break
+            except Exception:  # catch all
+                task.completed = False
+                import traceback
+                traceback.print_exc()
 
-                # print('Process background task:', method, task)
-                self.task_queue.task_done()
+            # print('Process background task:', method, task)
 
     def restart_autosync_thread(self):
         with self._stop_lock:
@@ -121,9 +275,9 @@ class SynchronizationServer:
             self._autosync_thread.start()
 
     def autosync_run(self):
-        if settings.AUTOSYNC_INTERVAL == '-1':
+        if settings.general.AUTOSYNC_INTERVAL == -1:
             return
-        while not self._autosync_stop.wait(timeout=int(settings.AUTOSYNC_INTERVAL)):
+        while not self._autosync_stop.wait(timeout=settings.general.AUTOSYNC_INTERVAL):
             try:
                 self._synchronize_todolist()
             except KeyboardInterrupt:
@@ -165,7 +319,7 @@ class SynchronizationServer:
 
                 # Nothing changed server side, so use client value.
                 if (
-                    settings.PRIORITIZE_ON_CONFLICT == 'SERVER' and
+                    settings.general.PRIORITIZE_ON_CONFLICT == 'SERVER' and
                     local_copy_of_remote_value == remote_copy_of_remote_value and
                     local_copy_of_local_value != remote_copy_of_remote_value
                 ):
@@ -173,7 +327,7 @@ class SynchronizationServer:
                     remote_copy_of_remote[key] = value
                 # Something changed client side, so use client value.
                 elif (
-                    settings.PRIORITIZE_ON_CONFLICT == 'CLIENT' and
+                    settings.general.PRIORITIZE_ON_CONFLICT == 'CLIENT' and
                     local_copy_of_local_value != local_copy_of_remote_value and
                     local_copy_of_local_value != remote_copy_of_remote_value
                 ):
@@ -184,94 +338,268 @@ class SynchronizationServer:
         else:
             assert False
 
+    def _synchronize_resource(
+        self, cal, batch, remote_todo, local_index, local_resources, local_changes, remote_uids,
+    ):
+        href = str(remote_todo.url)
+        etag = cal.etag(remote_todo)
+        # The resource is unchanged on both sides since the last synchronization, so there is nothing to parse.
+        stored_items = local_resources.get(href)
+        if etag is not None and stored_items and all(
+            local_item.etag == etag and local_item.uid not in local_changes for local_item in stored_items
+        ):
+            remote_uids.update(local_item.uid for local_item in stored_items)
+            return
+
+        if remote_todo.data is None:
+            remote_todo.load()
+        # Only the todos are parsed, along with the timezones they use. Everything else is kept as it is, and the
+        # calendar object is only put back together from the texts if it has to be saved.
+        pieces = split_calendar(remote_todo.data)
+        # Resources without any todos (e.g. events in a shared calendar) are none of our business.
+        if not any(name == 'VTODO' for name, _ in pieces):
+            return
+
+        vtimezones = [text for name, text in pieces if name == 'VTIMEZONE']
+        new_pieces = []
+        has_todo_component = False
+        updated_todo_component = False
+        # Only written locally once the server accepted the changes.
+        todos_to_update, todos_to_delete = [], []
+        for name, text in pieces:
+            # Keep all non-todo items unconditionally in case there are any.
+            if name != 'VTODO':
+                new_pieces.append(text)
+                continue
+
+            remote_item = parse_todo(text, vtimezones)
+            uid = str(remote_item['UID'])
+            remote_uids.add(uid)
+            try:
+                local_item = local_index[uid]
+            except KeyError:
+                # print(uid, 'does not exist locally. Creating...')
+                # Item exists on the server but does not exist locally AND was not deleted locally.
+                has_todo_component = True
+                new_pieces.append(text)
+                todos_to_update.append(remote_item)
+            else:
+                # Item exists on the server but does not exist locally AND was deleted locally.
+                if local_item.local_ical is None:
+                    # print(uid, 'was deleted locally. Deleting from server...')
+                    updated_todo_component = True
+                    todos_to_delete.append(remote_item)
+                # Item exists on both the server and the client, compare the todos
+                else:
+                    has_todo_component = True
+                    updated, item_to_use = self._merge_todo(
+                        uid,
+                        local_item.local_vtodo,
+                        local_item.remote_vtodo,
+                        remote_item,
+                    )
+                    updated_todo_component |= updated
+
+                    new_pieces.append(item_to_use.to_ical().decode() if updated else text)
+                    todos_to_update.append(item_to_use)
+
+        if not has_todo_component:
+            # Changed by another client in the meantime, so leave everything for the next synchronization.
+            if not cal.delete_todo(remote_todo, etag=etag):
+                return
+        elif updated_todo_component:
+            etag = cal.save_todo(remote_todo, ''.join(new_pieces), etag=etag)
+            # Changed by another client in the meantime, so leave everything for the next synchronization.
+            if etag is False:
+                return
+
+        for vtodo in todos_to_update:
+            batch.update_todo_from_server(vtodo, href=href, etag=etag)
+        for vtodo in todos_to_delete:
+            batch.delete_todo_from_server(vtodo)
+
+    def _push_todo(self, cal, vtodo, uid, vtimezone, deadline):
+        # Returns the href of the new resource.
+        vcal = icalendar.Calendar()
+        vcal.add('VERSION', '2.0')
+        vcal.add('PRODID', '-//Abeluna//NONSGML v1.0//EN')
+        vcal.add('CALSCALE', 'GREGORIAN')
+        if vtimezone is not None:
+            vcal.add_component(vtimezone)
+        vcal.add_component(vtodo)
+
+        for attempt in itertools.count():
+            self._check_deadline(cal, deadline)
+            remote_todo = caldav.Todo(cal.client, data=vcal, parent=cal.calendar, id=uid)
+            try:
+                remote_todo.save()
+            except (DAVError, OSError):
+                # The resource is named after the todo, so an upload that did succeed is simply overwritten.
+                backoff = self.PUSH_BACKOFF * 2 ** attempt
+                if attempt >= self.PUSH_RETRIES or self.timefunc() + backoff > deadline:
+                    raise
+                time.sleep(backoff)
+            else:
+                return str(remote_todo.url)
+
+    def _push_todos(self, cal, batch, local_items, deadline):
+        # Todos created locally are uploaded concurrently. The ones that were uploaded are added to the batch even if
+        # others failed, in which case the first error is raised afterwards.
+        if not local_items:
+            return
+        vtimezone = timezones.vtimezone()
+        vtodos = [local_item.local_vtodo for local_item in local_items]
+        error = None
+        with ThreadPoolExecutor(max_workers=min(settings.general.PUSH_WORKERS, len(local_items))) as executor:
+            futures = [
+                executor.submit(self._push_todo, cal, vtodo, local_item.uid, vtimezone, deadline)
+                for vtodo, local_item in zip(vtodos, local_items)
+            ]
+            for vtodo, future in zip(vtodos, futures):
+                try:
+                    href = future.result()
+                except Exception as e:  # catch all
+                    error = error or e
+                else:
+                    batch.update_todo_from_server(vtodo, href=href)
+        if error is not None:
+            raise error
+
+    def _check_deadline(self, cal, deadline):
+        if self.timefunc() > deadline:
+            raise TimeoutError(
+                'Synchronizing {} took longer than {} seconds.'.format(cal.name, settings.general.SYNC_TIMEOUT),
+            )
+
+    def _synchronize_calendar(self, cal, deadline):
+        incremental = settings.general.INCREMENTAL_SYNC
+        local_changes = cal.local_server.local_changes()
+        ctag = sync_token = None
+        if incremental:
+            ctag = cal.get_ctag()
+            old_ctag, old_sync_token = cal.local_server.sync_state()
+            # Nothing changed on either side since the last synchronization.
+            if ctag is not None and ctag == old_ctag and not local_changes:
+                return
+
+        local_todos = cal.local_server.todos(include_deleted=True)
+        local_index = {}
+        local_resources = defaultdict(list)
+        for local_item in local_todos:
+            local_index[local_item.uid] = local_item
+            if local_item.href is not None:
+                local_resources[local_item.href].append(local_item)
+
+        def expired():
+            return self.timefunc() > deadline
+
+        remote_todos = None
+        deleted_hrefs = set()
+        is_delta = False
+        # Whether every changed resource could be downloaded before the deadline.
+        complete = True
+        if incremental:
+            # Todos last synchronized by an older version have no href, so they can only be found with a full sync.
+            if any(
+                local_item.uid in local_changes and local_item.remote_ical is not None and local_item.href is None
+                for local_item in local_todos
+            ):
+                old_sync_token = None
+            try:
+                # Resources changed locally are downloaded along with the others, since they have to be merged.
+                remote_todos, deleted_hrefs, sync_token, complete = cal.sync_changes(
+                    old_sync_token,
+                    etags={
+                        href: items[0].etag for href, items in local_resources.items()
+                        if not any(local_item.uid in local_changes for local_item in items)
+                    },
+                    expired=expired,
+                )
+            except DAVError:
+                # The sync token expired or the server does not support sync-collection.
+                remote_todos = None
+            else:
+                is_delta = old_sync_token is not None and sync_token is not None
+        if remote_todos is None:
+            remote_todos = cal.calendar.todos(include_completed=True)
+
+        if is_delta and complete:
+            # Only resources changed on the server are reported, so fetch the resources changed locally as well.
+            fetched_hrefs = {str(remote_todo.url) for remote_todo in remote_todos}
+            to_load = []
+            for local_item in local_todos:
+                if local_item.uid not in local_changes or local_item.remote_ical is None:
+                    continue
+                if local_item.href in fetched_hrefs or local_item.href in deleted_hrefs:
+                    continue
+                to_load.append(cal.todo_by_href(local_item.href, etag=local_item.etag))
+                fetched_hrefs.add(local_item.href)
+            loaded, missing_hrefs, complete = cal.load_todos(to_load, expired=expired)
+            remote_todos.extend(loaded)
+            deleted_hrefs.update(missing_hrefs)
+
+        # Everything written locally during the pass is committed in a single transaction.
+        with cal.local_server.batch() as batch:
+            remote_uids = set()
+            local_items_to_push = []
+            for remote_todo in remote_todos:
+                if complete:
+                    self._check_deadline(cal, deadline)
+                self._synchronize_resource(
+                    cal, batch, remote_todo, local_index, local_resources, local_changes, remote_uids,
+                )
+
+            if not complete:
+                # Only some of the changed resources were downloaded in time. They are still processed and committed,
+                # so the next synchronization does not download them again, but nothing can be told about the others.
+                self._check_deadline(cal, deadline)
+
+            for local_item in local_todos:
+                # Item existed on server, so it was already processed.
+                if local_item.uid in remote_uids:
+                    continue
+
+                # Item has a record of being on the server, but it doesn't exist on the server anymore.
+                # We can only assume it was deleted server-side.
+                if local_item.remote_ical is not None:
+                    # During an incremental sync, the item was simply not changed on the server.
+                    if is_delta and local_item.href not in deleted_hrefs:
+                        continue
+                    # print(local_item.uid, 'was deleted on remote. Deleting locally...')
+                    batch.delete_todo_from_server(local_item.remote_vtodo)
+                # Item exists on client, has never existed on server, so create and push to the server.
+                else:
+                    # print(local_item.uid, 'was created locally. Pushing to remote...')
+                    local_items_to_push.append(local_item)
+
+            self._push_todos(cal, batch, local_items_to_push, deadline)
+
+            if incremental:
+                batch.update_sync_state(ctag, sync_token)
+
+    def _synchronize_calendar_with_status(self, cal):
+        start = self.timefunc()
+        try:
+            self._synchronize_calendar(cal, deadline=start + settings.general.SYNC_TIMEOUT)
+        except Exception as e:  # catch all
+            import traceback
+            traceback.print_exc()
+            return SyncStatus(succeeded=False, duration=self.timefunc() - start, error=str(e) or type(e).__name__)
+        return SyncStatus(succeeded=True, duration=self.timefunc() - start, error=None)
+
     def _synchronize_todolist(self):
         with self._sync_lock:
             for cb, args, kwargs in self._sync_callbacks:
                 cb(*args, mode='PRE_SYNC', **kwargs)
 
-            for cal in self.calendars.values():
-                try:
-                    if cal.is_local:
-                        continue
-                    remote_todos = cal.calendar.todos(include_completed=True)
-                    local_todos = cal.local_server.todos(include_deleted=True)
-
-                    remote_uids = set()
-                    for remote_todo in remote_todos:
-                        remote_ical = remote_todo.icalendar_instance
-                        new_cal = remote_ical.copy()
-                        has_todo_component = False
-                        updated_todo_component = False
-                        for remote_item in remote_todo.icalendar_instance.subcomponents:
-                            # Keep all non-todo items unconditionally in case there are any.
-                            if not isinstance(remote_item, icalendar.Todo):
-                                new_cal.add_component(remote_item)
-                                continue
-
-                            uid = str(remote_item['UID'])
-                            remote_uids.add(uid)
-                            try:
-                                local_item = local_todos[local_todos.index(uid)]
-                            except ValueError:
-                                # print(uid, 'does not exist locally. Creating...')
-                                # Item exists on the server but does not exist locally AND was not deleted locally.
-                                has_todo_component = True
-                                new_cal.add_component(remote_item)
-                                cal.local_server.update_todo_from_server(remote_item)
-                            else:
-                                # Item exists on the server but does not exist locally AND was deleted locally.
-                                if local_item.local_vtodo is None:
-                                    # print(uid, 'was deleted locally. Deleting from server...')
-                                    updated_todo_component = True
-                                    cal.local_server.delete_todo_from_server(remote_item)
-                                # Item exists on both the server and the client, compare the todos
-                                else:
-                                    has_todo_component = True
-                                    updated, item_to_use = self._merge_todo(
-                                        uid,
-                                        local_item.local_vtodo,
-                                        local_item.remote_vtodo,
-                                        remote_item,
-                                    )
-                                    updated_todo_component |= updated
-
-                                    new_cal.add_component(item_to_use)
-                                    cal.local_server.update_todo_from_server(item_to_use)
-
-                        if not has_todo_component:
-                            remote_todo.delete()
-                        elif updated_todo_component:
-                            remote_todo.icalendar_instance = new_cal
-                            remote_todo.save()
-
-                    for local_item in local_todos:
-                        # Item existed on server, so it was already processed.
-                        if local_item.uid in remote_uids:
-                            continue
-
-                        # Item has a record of being on the server, but it doesn't exist on the server anymore.
-                        # We can only assume it was deleted server-side.
-                        if local_item.remote_vtodo is not None:
-                            # print(local_item.uid, 'was deleted on remote. Deleting locally...')
-                            cal.local_server.delete_todo_from_server(local_item.remote_vtodo)
-                        # Item exists on client, has never existed on server, so create and push to the server.
-                        else:
-                            # print(local_item.uid, 'was created locally. Pushing to remote...')
-                            vcal = icalendar.Calendar()
-                            vcal.add('VERSION', '2.0')
-                            vcal.add('PRODID', '-//Abeluna//NONSGML v1.0//EN')
-                            vcal.add('CALSCALE', 'GREGORIAN')
-                            vtimezone = generate_vtimezone()
-                            if vtimezone is not None:
-                                vcal.add_component(vtimezone)
-                            vcal.add_component(local_item.local_vtodo)
-                            caldav.Todo(cal.client, data=vcal, parent=cal.calendar, id=local_item.uid).save()
-                            cal.local_server.update_todo_from_server(local_item.local_vtodo)
-                except Exception:
-                    import traceback
-                    traceback.print_exc()
-
-            self.initialize_todolist()
+            # Calendars are synchronized concurrently so that a slow server does not hold up the others.
+            remote_calendars = [cal for cal in self.calendars.values() if not cal.is_local]
+            futures = {
+                cal.uid: self._sync_executor.submit(self._synchronize_calendar_with_status, cal)
+                for cal in remote_calendars
+            }
+            self.sync_status = {uid: future.result() for uid, future in futures.items()}
+
             self.last_sync = datetime.datetime.now()
             for cb, args, kwargs in self._sync_callbacks:
                 cb(*args, mode='POST_SYNC', **kwargs)
@@ -281,20 +609,6 @@ class SynchronizationServer:
         self._synchronize_todolist()
         return True
 
-    def initialize_todolist(self, uid=None):
-        with self._sync_lock:
-            if uid is not None:
-                try:
-                    calendar = self.calendars[uid]
-                except KeyError:
-                    pass
-                else:
-                    self.todolist[uid] = [item.local_vtodo for item in calendar.local_server.todos()]
-            else:
-                self.todolist.clear()
-                for uid, cal in self.calendars.items():
-                    self.todolist[uid] = [item.local_vtodo for item in cal.local_server.todos()]
-
     def refresh_calendars(self):
         new_calendars = {}
         for uid, cal_dict in settings.ordered_calendars.items():
@@ -303,42 +617,99 @@ class SynchronizationServer:
 
         with self._sync_lock:
             self.calendars = new_calendars
-            self.initialize_todolist()
+        # The databases were upgraded when the calendars were created.
+        self._shutdown_parse_pool()
+
+    def update_todo(self, vtodo, cal_uid, uid=None):
+        # Saves are debounced per todo, e.g. when the user is editing a textbox, don't save after every keystroke.
+        # Only the latest VTODO is kept, and it is saved once the todo has not changed for SAVE_INTERVAL seconds,
+        # or at the latest SAVE_MAX_WAIT seconds after the first unsaved change.
+        # The VTODO can also be a function that builds it when it is saved, in which case the UID must be given.
+        if uid is None:
+            uid = str(vtodo['UID'])
+        _time = self.timefunc()
+        with self._general_lock:
+            try:
+                pending = self._pending_saves[uid]
+            except KeyError:
+                self._pending_saves[uid] = PendingSave(vtodo, cal_uid, first_change=_time, last_change=_time)
+                self._flush_todo(uid, delay=settings.general.SAVE_INTERVAL)
+            else:
+                self._pending_saves[uid] = pending._replace(vtodo=vtodo, cal_uid=cal_uid, last_change=_time)
 
     @background_task
-    def update_todo(self, task, vtodo, cal_uid, postpone=True):
-        uid = str(vtodo['UID'])
+    def _flush_todo(self, task, uid):
         _time = self.timefunc()
         with self._general_lock:
-            # Some sketchy logic to "batch" saves together.
-            # E.g when the user is editting a textbox, don't save after every keystroke.
-            if postpone:
-                if uid not in self._update_todo_skip:
-                    self.update_todo(vtodo, cal_uid, task=task, postpone=False)
-                self._update_todo_skip[uid] = _time
+            try:
+                pending = self._pending_saves[uid]
+            except KeyError:
+                # Already flushed or deleted.
                 return False
-            else:
-                time_diff = int(settings.SAVE_INTERVAL) - (_time - self._update_todo_skip.get(uid, 0))
-                if time_diff > 0:
-                    self.update_todo(vtodo, cal_uid, task=task, postpone=False, delay=time_diff)
-                    return False
-                else:
-                    try:
-                        self._update_todo_skip.pop(uid)
-                    except KeyError:
-                        pass
+            deadline = min(
+                pending.last_change + settings.general.SAVE_INTERVAL,
+                pending.first_change + settings.general.SAVE_MAX_WAIT,
+            )
+            if deadline > _time:
+                self._flush_todo(uid, task=task, delay=deadline - _time)
+                return False
+            del self._pending_saves[uid]
 
+        self._save_todo(pending.vtodo, pending.cal_uid)
+        return True
+
+    def flush_pending_saves(self):
+        with self._general_lock:
+            pending_saves, self._pending_saves = self._pending_saves, {}
+        for pending in pending_saves.values():
+            try:
+                self._save_todo(pending.vtodo, pending.cal_uid)
+            except Exception:  # catch all
+                import traceback
+                traceback.print_exc()
+
+    def _save_todo(self, vtodo, cal_uid):
+        if callable(vtodo):
+            vtodo = vtodo()
         with self._sync_lock:
             self.calendars[cal_uid].local_server.update_todo_from_client(vtodo)
-            self.initialize_todolist(uid=cal_uid)
-        return True
 
     @background_task
     def delete_todo(self, task, vtodo, cal_uid):
+        uid = str(vtodo['UID'])
+        # A save that is still pending would otherwise bring the todo back.
+        with self._general_lock:
+            self._pending_saves.pop(uid, None)
         with self._sync_lock:
             self.calendars[cal_uid].local_server.delete_todo_from_client(vtodo)
-            self.initialize_todolist(uid=cal_uid)
         return True
 
+    def query_todos(self, cal_uid, **kwargs):
+        # Rows of the todos of a calendar, see LocalServer.query_todos. Only reads the local database, so it does not
+        # wait for a synchronization to finish.
+        try:
+            local_server = self.calendars[cal_uid].local_server
+        except KeyError:
+            return []
+        return local_server.query_todos(**kwargs)
+
+    def smart_list_filters(self, key):
+        # Filters of LocalServer.query_todos for the todos of the smart list, in every calendar. Dates and floating
+        # times are stored in the local time of the system, like the todo list shows them, so the days of the lists
+        # start at its midnight as well.
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        return dict(SMART_LISTS[key].filters(today), exclude_status=('COMPLETED', 'CANCELLED'))
+
+    def search_todos(self, text, limit=50):
+        # (calendar UID, todo UID, summary) of the todos of all calendars that match the text, best match first.
+        # Only reads the local databases, so it does not wait for a synchronization to finish.
+        results = []
+        for cal_uid, cal in list(self.calendars.items()):
+            results.extend(
+                (rank, cal_uid, uid, summary) for uid, summary, rank in cal.local_server.search_todos(text, limit)
+            )
+        results.sort(key=lambda result: result[0])
+        return [(cal_uid, uid, summary) for _, cal_uid, uid, summary in results[:limit]]
+
 
 server = SynchronizationServer()
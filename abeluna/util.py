@@ -1,4 +1,5 @@
 import datetime
+import threading
 
 import icalendar
 import pytz
@@ -68,5 +69,35 @@ def generate_vtimezone(timezone=None, for_date=None):
         return _vtimezone_without_dst(std, timezone)
 
 
+class TimezoneService:
+    # Caches the VTIMEZONEs generated for the timezone of the TIMEZONE setting per year.
+    # They are dropped as soon as the setting changes.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tz = None
+        self._vtimezones = {}
+
+    @property
+    def tz(self):
+        return settings.general.TIMEZONE
+
+    def vtimezone(self, for_date=None):
+        # The component is shared, so it must not be modified.
+        if for_date is None:
+            for_date = datetime.datetime.now()
+        tz = self.tz
+        with self._lock:
+            if tz is not self._tz:
+                self._tz, self._vtimezones = tz, {}
+            try:
+                return self._vtimezones[for_date.year]
+            except KeyError:
+                vtimezone = self._vtimezones[for_date.year] = generate_vtimezone(tz.zone, for_date)
+                return vtimezone
+
+
+timezones = TimezoneService()
+
+
 def colour_text(text, colour):
     return '<span foreground="{colour}">{text}</span>'.format(colour=colour, text=text)
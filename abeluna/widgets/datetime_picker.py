@@ -1,10 +1,9 @@
 import calendar
 import datetime
 
-import pytz
 from gi.repository import GObject, Gtk
 
-from abeluna.settings import settings
+from abeluna.util import timezones
 from abeluna.widgets.dropdown_select import DropdownSelectWidget
 
 
@@ -50,7 +49,7 @@ class DateTimePickerWidget(Gtk.Grid):
             return self._tz
         if self.get_time_only():
             return None
-        return pytz.timezone(settings.TIMEZONE)
+        return timezones.tz
 
     def get_date_only(self):
         return self.visible_parts == 'DATE'
@@ -234,6 +234,24 @@ class SettingsWindow(Gtk.Window):
             1,
         )
 
+        self.incremental_sync_label = Gtk.Label(label='Incremental synchronization')
+        self.incremental_sync_selector = Gtk.CheckButton()
+        self.incremental_sync_selector.set_active(int(settings.INCREMENTAL_SYNC))
+        self.general_page_grid.attach_next_to(
+            self.incremental_sync_label,
+            self.all_day_due_time_label,
+            Gtk.PositionType.BOTTOM,
+            2,
+            1,
+        )
+        self.general_page_grid.attach_next_to(
+            self.incremental_sync_selector,
+            self.incremental_sync_label,
+            Gtk.PositionType.RIGHT,
+            4,
+            1,
+        )
+
         self.saved_label = Gtk.Label(label=' ')
         self.saved_label.set_xalign(0.95)
         self.saved_label.set_yalign(0.75)
@@ -248,6 +266,7 @@ class SettingsWindow(Gtk.Window):
             priority = self.priority_selector.get_active_id()
             hide_completed = str(int(self.hide_completed_selector.get_active()))
             all_day_due_time = self.all_day_due_time_picker.get_selected_date().strftime('%H:%M')
+            incremental_sync = str(int(self.incremental_sync_selector.get_active()))
 
             failed_settings = []
             for obj, name in (
@@ -280,6 +299,7 @@ class SettingsWindow(Gtk.Window):
                     settings.AUTOSYNC_INTERVAL = autosync_interval
                     server.restart_autosync_thread()
                 settings.PRIORITIZE_ON_CONFLICT = priority
+                settings.INCREMENTAL_SYNC = incremental_sync
                 settings.commit()
 
                 if rebuild_todolist:
@@ -292,7 +312,7 @@ class SettingsWindow(Gtk.Window):
         self.save_button.set_margin_top(20)
         self.save_button.connect('clicked', save_button_clicked)
 
-        self.general_page_grid.attach(self.save_button, 4, 6, 2, 1)
+        self.general_page_grid.attach(self.save_button, 4, 7, 2, 1)
         self.general_page_grid.attach_next_to(self.saved_label, self.save_button, Gtk.PositionType.LEFT, 2, 1)
 
         padding = Gtk.Box()
@@ -1,6 +1,10 @@
 import datetime
+import hashlib
+import heapq
+import itertools
+import threading
 import uuid
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
 import humanize
 import icalendar
@@ -8,8 +12,9 @@ import pytz
 from gi.repository import GObject, Gdk, Gtk
 
 from abeluna.settings import settings
-from abeluna.sync import server
-from abeluna.util import colour_text
+from abeluna.sync import SMART_LISTS, server
+from abeluna.sync.local import LocalServer, decode_todo_fields, load_todo_records, todo_sort_value
+from abeluna.util import colour_text, timezones
 from abeluna.widgets import DateTimePickerWidget, DropdownSelectWidget
 
 
@@ -36,8 +41,30 @@ DEFAULT_DATA = {
 }
 
 
+class TodoSignals:
+    # Callbacks shared by all todos, which are called with the todo that changed.
+    def __init__(self, fields, do_not_track=()):
+        self.tracked_fields = [field for field in fields if field not in do_not_track]
+        self.callback_mapping = defaultdict(list)
+
+    def connect(self, field, callback, *args, **kwargs):
+        self.callback_mapping[field].append((callback, args, kwargs))
+
+    def connect_to_all(self, callback, *args, **kwargs):
+        for field in self.tracked_fields:
+            self.connect(field, callback, *args, **kwargs)
+
+    def emit(self, field, todo):
+        for cb, args, kwargs, in self.callback_mapping[field]:
+            cb(todo, *args, **kwargs)
+
+
 class Todo:
+    # Todos are kept for every task of the calendar, so the field values are stored in a list rather than a dict.
+    __slots__ = ('_values', '_vtodo', '_record', '_dirty')
+
     FIELDS = list(DEFAULT_DATA.keys())
+    FIELD_INDEX = {field: index for index, field in enumerate(FIELDS)}
     CLASS_OPTIONS = [
         ('PUBLIC', 'Show full event'),
         ('CONFIDENTIAL', 'Show only busy'),
@@ -54,6 +81,9 @@ class Todo:
     DO_NOT_TRACK = ('last_modified_date', 'sequence', 'completed_date', 'dtstamp', 'created_date')
     DO_NOT_LOAD = ('uid', 'sequence', 'created_date', 'dtstamp', 'last_modified_date', 'hide_subtasks')
 
+    signals = TodoSignals(FIELDS, DO_NOT_TRACK)
+    _vtodo_lock = threading.Lock()
+
     UTC_DATE_FIELDS = ('created_date', 'completed_date', 'dtstamp', 'last_modified_date')
     LOCAL_DATE_FIELDS = ('start_date', 'end_date')
     DATE_FIELDS = UTC_DATE_FIELDS + LOCAL_DATE_FIELDS
@@ -80,48 +110,43 @@ class Todo:
 
     @classmethod
     def load_from_vtodo(cls, vtodo, load_all=True):
-        kwargs = {}
-
-        def _sanitize(val):
-            if isinstance(val, icalendar.vText):
-                return str(val)
-            elif isinstance(val, icalendar.prop.vCategory):
-                _tmp_vals = []
-                for cat in val.cats:
-                    if isinstance(cat, icalendar.vText):
-                        _tmp_vals.append(str(cat))
-                    else:
-                        _tmp_vals.append(cat)
-                return _tmp_vals
-            return val
+        return cls._load_fields(decode_todo_fields(vtodo), load_all=load_all, vtodo=vtodo)
 
-        def _normalize_datetime(date):
-            dt = date.dt
-            if not isinstance(dt, datetime.datetime):
-                dt = datetime.datetime(year=dt.year, month=dt.month, day=dt.day)
-            return dt.astimezone(pytz.timezone(settings.TIMEZONE))
+    @classmethod
+    def load_from_record(cls, record):
+        return cls._load_fields(record.fields, record=record)
 
+    @staticmethod
+    def normalize_datetime(dt):
+        if not isinstance(dt, datetime.datetime):
+            dt = datetime.datetime(year=dt.year, month=dt.month, day=dt.day)
+        return dt.astimezone(timezones.tz)
+
+    @classmethod
+    def _load_fields(cls, fields, load_all=True, **kwargs):
         for field_model, field_vtodo in cls.VTODO_MAPPING:
             if not load_all and field_model in cls.DO_NOT_LOAD:
                 continue
             try:
-                val = vtodo[field_vtodo]
+                kwargs[field_model] = fields[field_vtodo]
             except KeyError:
                 pass
-            else:
-                kwargs[field_model] = _sanitize(val)
 
         for dt in ('start_date', 'end_date'):
-            if dt in kwargs and not isinstance(kwargs[dt].dt, datetime.datetime):
+            if dt in kwargs and not isinstance(kwargs[dt], datetime.datetime):
                 kwargs['all_day'] = True
         for dt in cls.DATE_FIELDS:
             if dt in kwargs:
-                kwargs[dt] = _normalize_datetime(kwargs[dt])
+                kwargs[dt] = cls.normalize_datetime(kwargs[dt])
 
-        return cls(vtodo=vtodo, **kwargs)
+        return cls(**kwargs)
 
-    def update_vtodo(self):
-        _fields = self.fields.copy()
+    def update_vtodo(self, fields=None):
+        # Rebuilds the properties of the given fields, or of all of them.
+        fields = set(self.FIELDS if fields is None else fields)
+        if 'all_day' in fields:
+            fields.update(('start_date', 'end_date'))
+        _fields = self.fields
 
         def _sanitize(field, val):
             if field == 'categories':
@@ -130,10 +155,10 @@ class Todo:
 
         for field_list, timezone in (
             (self.UTC_DATE_FIELDS, pytz.UTC),
-            (self.LOCAL_DATE_FIELDS, pytz.timezone(settings.TIMEZONE)),
+            (self.LOCAL_DATE_FIELDS, timezones.tz),
         ):
             for dt_field in field_list:
-                if _fields[dt_field] is not None:
+                if dt_field in fields and _fields[dt_field] is not None:
                     _fields[dt_field] = _fields[dt_field].astimezone(timezone)
 
         if _fields['all_day']:
@@ -142,71 +167,88 @@ class Todo:
                     _fields[dt] = _fields[dt].date()
 
         for field_model, field_vtodo in self.VTODO_MAPPING:
+            if field_model not in fields:
+                continue
             val = _fields[field_model]
             try:
-                self.vtodo.pop(field_vtodo)
+                self._vtodo.pop(field_vtodo)
             except KeyError:
                 pass
             if val not in (None, '', []):
-                self.vtodo.add(field_vtodo, _sanitize(field_model, val))
+                self._vtodo.add(field_vtodo, _sanitize(field_model, val))
 
     def now(self, aware):
         if aware:
-            return datetime.datetime.now(pytz.timezone(settings.TIMEZONE))
+            return datetime.datetime.now(timezones.tz)
         else:
             return datetime.datetime.now()
 
     def __init__(self, **kwargs):
-        self.vtodo = kwargs.pop('vtodo', None)
-        self.callback_mapping = defaultdict(list)
-        self.fields = DEFAULT_DATA.copy()
-        self.fields['uid'] = uuid.uuid4().hex
-        self.fields['created_date'] = self.fields['dtstamp'] = self.fields['last_modified_date'] = self.now(aware=True)
-        self.fields.update(**kwargs)
-
-        if self.vtodo is None:
-            self.vtodo = icalendar.Todo()
-        self.update_vtodo()
-
-        def on_complete():
-            if self.completed_date is not None and not self.completed:
-                self.completed_date = None
-            elif self.completed_date is None and self.completed:
-                self.completed_date = self.now(aware=True)
-        self.connect('progress', on_complete)
-        self.connect('status', on_complete)
-
-        def update():
-            _now = self.now(aware=True)
-            if (
-                self.last_modified_date is not None and
-                abs(self.last_modified_date - _now).total_seconds() > 60
-            ):
-                self.sequence += 1
-            self.last_modified_date = _now
-
-        self.connect_to_all(update)
+        self._vtodo = kwargs.pop('vtodo', None)
+        self._record = kwargs.pop('record', None)
+        fields = DEFAULT_DATA.copy()
+        fields['uid'] = uuid.uuid4().hex
+        fields['created_date'] = fields['dtstamp'] = fields['last_modified_date'] = self.now(aware=True)
+        fields.update(**kwargs)
+        self._values = [fields[field] for field in self.FIELDS]
+
+        # Fields that changed since the component was last built.
+        self._dirty = None
+        if self._vtodo is None and self._record is None:
+            self._vtodo = icalendar.Todo()
+        if self._vtodo is not None:
+            self._dirty = set(self.FIELDS)
+
+    def on_complete(self):
+        if self.completed_date is not None and not self.completed:
+            self.completed_date = None
+        elif self.completed_date is None and self.completed:
+            self.completed_date = self.now(aware=True)
+
+    def on_update(self):
+        _now = self.now(aware=True)
+        if (
+            self.last_modified_date is not None and
+            abs(self.last_modified_date - _now).total_seconds() > 60
+        ):
+            self.sequence += 1
+        self.last_modified_date = _now
 
-    def connect(self, field, callback, *args, **kwargs):
-        self.callback_mapping[field].append((callback, args, kwargs))
+    @property
+    def vtodo(self):
+        return self.build_vtodo()
+
+    def build_vtodo(self):
+        # The component is only brought up to date when it is read, e.g. when the todo is saved, which can be
+        # from the sync thread. Todos loaded from a record only parse their component at that point.
+        with self._vtodo_lock:
+            dirty, self._dirty = self._dirty, None
+            if self._vtodo is None:
+                self._vtodo, self._record = self._record.vtodo, None
+                dirty = self.FIELDS
+            if dirty:
+                self.update_vtodo(dirty)
+            return self._vtodo
 
-    def connect_to_all(self, callback, *args, **kwargs):
-        for field in self.FIELDS:
-            if field not in self.DO_NOT_TRACK:
-                self.connect(field, callback, *args, **kwargs)
+    @property
+    def fields(self):
+        return dict(zip(self.FIELDS, self._values))
 
     def __getattr__(self, field):
-        if field in self.FIELDS:
-            return self.fields[field]
+        if field in self.FIELD_INDEX:
+            return self._values[self.FIELD_INDEX[field]]
         raise AttributeError()
 
     def __setattr__(self, field, value):
-        if field in self.FIELDS:
-            if value != self.fields[field]:
-                self.fields[field] = value
-                self.update_vtodo()
-                for cb, args, kwargs, in self.callback_mapping[field]:
-                    cb(*args, **kwargs)
+        if field in self.FIELD_INDEX:
+            index = self.FIELD_INDEX[field]
+            if value != self._values[index]:
+                self._values[index] = value
+                with self._vtodo_lock:
+                    if self._dirty is None:
+                        self._dirty = set()
+                    self._dirty.add(field)
+                self.signals.emit(field, self)
         else:
             super().__setattr__(field, value)
 
@@ -234,7 +276,7 @@ class Todo:
         def _convert_datetime(dt):
             if dt is None:
                 return None
-            return dt.astimezone(pytz.timezone(settings.TIMEZONE)).replace(tzinfo=None)
+            return dt.astimezone(timezones.tz).replace(tzinfo=None)
 
         _now = _convert_datetime(self.now(aware=True))
 
@@ -266,7 +308,7 @@ class Todo:
             if self.all_day and abs(_now - _end) < datetime.timedelta(days=1):
                 _end = datetime.datetime.combine(
                     date=_end.date(),
-                    time=datetime.datetime.strptime(settings.ALL_DAY_DUE_TIME, '%H:%M').time(),
+                    time=settings.general.ALL_DAY_DUE_TIME,
                 )
 
             if _end < _now:
@@ -281,28 +323,54 @@ class Todo:
                 )
         return ''
 
-    @property
-    def sort_value(self):
-        _GAP = 2**34
-        _MIN_BOUND = 0
-        _COMPLETED_BOUND = _GAP
-        _PRIORITY_BOUND = _GAP * 2
-        _END_DATE_BOUND = _GAP * 3
+    def time_display_expiry(self):
+        # The earliest time at which time_display may read differently, or None if it no longer depends on the time.
+        # Labels are coarser the further away a date is, e.g. they only change once a day when it is days away.
+        _DAY = 24 * 3600
+        _NATURALDATE_DAYS = 30 * _DAY
+        _NATURALDATE_MONTHS = 5 * 365 // 12 * _DAY
 
-        _now = self.now(aware=True)
         if self.completed:
-            if self.completed_date is None:
-                return _MIN_BOUND
-            return _COMPLETED_BOUND - int((_now - self.completed_date).total_seconds() // 60)
+            dates = [self.completed_date]
         elif self.status == 'CANCELLED':
-            return _COMPLETED_BOUND + 1
-        elif self.status == 'IN-PROCESS':
-            return _PRIORITY_BOUND + 1
-        elif self.end_date is not None:
-            return _END_DATE_BOUND - int((self.end_date - _now).total_seconds() // 60)
-        elif self.priority:
-            return _PRIORITY_BOUND - self.priority
-        return _COMPLETED_BOUND + 2
+            dates = []
+        else:
+            dates = [self.start_date, self.end_date]
+
+        _now = self.now(aware=True)
+        expiry = None
+        for dt in dates:
+            if dt is None:
+                continue
+            delta = (_now - dt).total_seconds()
+            past, delta = delta >= 0, abs(delta)
+            if delta < _DAY:
+                wait = 0
+            elif delta < _NATURALDATE_DAYS:
+                wait = _DAY - delta % _DAY if past else delta % _DAY
+            elif not past:
+                wait = delta - (_NATURALDATE_MONTHS if delta > _NATURALDATE_MONTHS else _NATURALDATE_DAYS)
+            elif delta < _NATURALDATE_MONTHS:
+                wait = _NATURALDATE_MONTHS - delta
+            else:
+                continue
+            if expiry is None or wait < expiry:
+                expiry = wait
+        return None if expiry is None else _now + datetime.timedelta(seconds=expiry)
+
+    @property
+    def sort_value(self):
+        def _timestamp(dt):
+            return None if dt is None else int(dt.timestamp())
+
+        return todo_sort_value(
+            self.completed, self.status, _timestamp(self.completed_date), _timestamp(self.end_date), self.priority,
+        )
+
+
+Todo.signals.connect('progress', Todo.on_complete)
+Todo.signals.connect('status', Todo.on_complete)
+Todo.signals.connect_to_all(Todo.on_update)
 
 
 CHAR_LONG_LIMIT = 2048
@@ -564,7 +632,27 @@ class TodoEditor(Gtk.Grid):
         self.attach_next_to(self.description_window, self.description_label, Gtk.PositionType.RIGHT, 4, 1)
 
 
+class TodoRow(namedtuple('TodoRow', 'uid ical has_children parent sort_value rowid')):
+    __slots__ = ()
+
+    # A row of TodoListWindow.ROW_COLUMNS. Todos whose version did not change are not loaded again. Their text is
+    # compared, since many clients bump neither SEQUENCE nor LAST-MODIFIED, which is stored in whole seconds anyway.
+    @property
+    def version(self):
+        return hashlib.sha1(self.ical.encode()).digest()
+
+    @property
+    def key(self):
+        return (self.sort_value, self.rowid)
+
+
 class TodoListWindow(Gtk.Grid):
+    # Number of top-level rows that are added at a time, more are added when scrolling to the end of the list.
+    PAGE_SIZE = 200
+    PLACEHOLDER_ROW = ['', '', False, 0, '', '', 0]
+    # Columns of LocalServer.query_todos that rows are added from.
+    ROW_COLUMNS = ('uid', 'local_vtodo', 'has_children', 'parent', 'sort_value', 'rowid')
+
     def __init__(self):
         super().__init__()
 
@@ -574,8 +662,24 @@ class TodoListWindow(Gtk.Grid):
         self.store = Gtk.TreeStore(str, str, bool, int, str, str, GObject.TYPE_UINT64)
         self.data = {}
         self.todo_uid_to_iter = {}
+        self._data_versions = {}
+        self._time_display_expiry = {}
+        # Rows are only created for the todos that are shown, which are read from the local databases. The children of
+        # a row are only added when it is expanded. Until then, it has a placeholder child.
+        self._calendars = []
+        self._filters = {}
+        self._unloaded_rows = set()
+        # Top-level rows are added a page at a time, in LocalServer.LIST_ORDER. The key of the last top-level todo
+        # added from each calendar, the calendars whose top-level todos were all added, and the key of the last
+        # top-level todo added overall.
+        self._cursors = {}
+        self._finished_calendars = set()
+        self._last_top_level = None
         self._reset_old_path = None
         self._current_calendar = None
+        self._loaded_calendar = None
+        # The calendar of each todo that is shown.
+        self._todo_calendars = {}
 
         self.sorted_store = Gtk.TreeModelSort(model=self.store)
         self.sorted_store.set_sort_column_id(6, Gtk.SortType.DESCENDING)
@@ -607,6 +711,7 @@ class TodoListWindow(Gtk.Grid):
         self.tree_view.connect('row-activated', self.tree_view_row_activated)
         self.tree_view.connect('row-collapsed', self.tree_view_row_visibility_changed, True)
         self.tree_view.connect('row-expanded', self.tree_view_row_visibility_changed, False)
+        self.tree_view.connect('test-expand-row', self.tree_view_test_expand_row)
         self.tree_view.get_selection().connect('changed', self.tree_selection_changed)
         self.tree_view.set_enable_tree_lines(True)
         self.tree_view.set_enable_search(True)
@@ -618,6 +723,10 @@ class TodoListWindow(Gtk.Grid):
         self.todo_scrollable_view.add(self.tree_view)
         self.todo_scrollable_view.get_hadjustment().connect('value-changed', self.reset_action_popover)
         self.todo_scrollable_view.get_vadjustment().connect('value-changed', self.reset_action_popover)
+        self.todo_scrollable_view.get_vadjustment().connect('value-changed', self.update_natural_dates)
+        self.todo_scrollable_view.get_vadjustment().connect('changed', self.update_natural_dates)
+        self.todo_scrollable_view.get_vadjustment().connect('value-changed', self.load_rows_on_scroll)
+        self.todo_scrollable_view.get_vadjustment().connect('changed', self.load_rows_on_scroll)
         self.attach(self.todo_scrollable_view, 0, 0, 7, 1)
 
         self.editor_view = TodoEditor()
@@ -634,7 +743,7 @@ class TodoListWindow(Gtk.Grid):
             def propagate_delete(cur_iter):
                 uid = self.store[cur_iter][5]
 
-                server.delete_todo(self.data[uid].vtodo, self._current_calendar)
+                server.delete_todo(self.data[uid].vtodo, self.todo_calendar(uid))
                 del self.todo_uid_to_iter[uid]
                 del self.data[uid]
 
@@ -670,86 +779,353 @@ class TodoListWindow(Gtk.Grid):
 
         self.popover.add(self.popover_grid)
 
+        self.connect_todo_signals()
         GObject.timeout_add_seconds(30, self.update_natural_dates)
 
-    def update_natural_dates(self):
-        for uid, it in self.todo_uid_to_iter.items():
-            self.store[it][1] = self.data[uid].time_display
+    def update_natural_dates(self, *args):
+        # Only the rows on screen whose label may have changed are refreshed. Rows that are scrolled to or expanded
+        # later are refreshed then.
+        _now = datetime.datetime.now(timezones.tz)
+        for it in self.iterate_visible_rows():
+            uid = self.store[it][5]
+            expiry = self._time_display_expiry.get(uid)
+            if expiry is not None and expiry <= _now:
+                self.store[it][1] = self.time_display(uid)
         return True
 
-    def rebuild_todolist(self):
+    def time_display(self, uid):
+        todo = self.data[uid]
+        self._time_display_expiry[uid] = todo.time_display_expiry()
+        return todo.time_display
+
+    def iterate_visible_rows(self):
+        # Store iterators of the rows on screen, in the order they are shown.
+        visible_range = self.tree_view.get_visible_range()
+        if visible_range is None:
+            return
+        start_path, end_path = visible_range
+        it = self.sorted_store.get_iter(start_path)
+        while it is not None:
+            path = self.sorted_store.get_path(it)
+            yield self.sorted_store.convert_iter_to_child_iter(it)
+            if path.compare(end_path) >= 0:
+                return
+            if self.tree_view.row_expanded(path):
+                it = self.sorted_store.iter_children(it)
+                continue
+            while it is not None:
+                next_it = self.sorted_store.iter_next(it)
+                if next_it is not None:
+                    it = next_it
+                    break
+                it = self.sorted_store.iter_parent(it)
+
+    def rebuild_todolist(self, reconcile=False):
         path_iter = self.tree_view.get_selection().get_selected()[1]
         if path_iter is None:
             _currently_selected_uid = None
         else:
             _currently_selected_uid = self.sorted_store[path_iter][5]
 
+        # Only the rows that changed are touched, which keeps the expanded rows and the scroll position.
+        if reconcile and self._current_calendar is not None and self._loaded_calendar == self._current_calendar:
+            replaced = self._reconcile_todolist()
+        else:
+            replaced = set()
+            self._rebuild_todolist()
+
+        try:
+            self.tree_view.get_selection().select_iter(
+                self.sorted_store.convert_child_iter_to_iter(self.todo_uid_to_iter[_currently_selected_uid])[1],
+            )
+        except KeyError:
+            self.tree_selection_changed()
+        else:
+            if _currently_selected_uid in replaced:
+                self.editor_view.set_data(self.data[_currently_selected_uid])
+
+    def _update_filters(self):
+        # The calendars whose todos are shown, and the filters of LocalServer.query_todos for the todos that are shown.
+        if self._current_calendar in SMART_LISTS:
+            self._calendars = list(server.calendars)
+            self._filters = server.smart_list_filters(self._current_calendar)
+        else:
+            self._calendars = [self._current_calendar]
+            self._filters = {'exclude_completed': bool(settings.general.HIDE_COMPLETED)}
+
+    def _query(self, cal_uid, **kwargs):
+        return server.query_todos(cal_uid, **self._filters, **kwargs)
+
+    def _query_rows(self, cal_uid, **kwargs):
+        return [TodoRow(*row) for row in self._query(cal_uid, columns=self.ROW_COLUMNS, **kwargs)]
+
+    def _todo_parent(self, cal_uid, uid):
+        # UID of the row the todo is shown under, None at the top level, or False if the todo is not shown.
+        rows = self._query(cal_uid, columns=('parent',), uids=[uid])
+        return rows[0][0] if rows else False
+
+    def _rebuild_todolist(self):
         self.store.clear()
         self.data.clear()
         self.todo_uid_to_iter.clear()
+        self._data_versions.clear()
+        self._time_display_expiry.clear()
+        self._todo_calendars.clear()
+        self._unloaded_rows.clear()
+        self._cursors.clear()
+        self._finished_calendars.clear()
+        self._last_top_level = None
+        self._loaded_calendar = self._current_calendar
 
         if self._current_calendar is not None:
-            adjacency_list = defaultdict(list)
+            self._update_filters()
+            self.load_more_rows()
+
+    def _reconcile_todolist(self):
+        # Returns the UIDs whose Todo object was replaced.
+        self._update_filters()
+
+        # Rows of the todos that are shown, todos that are no longer in the list are left out.
+        shown = defaultdict(list)
+        for uid in self.todo_uid_to_iter:
+            shown[self.todo_calendar(uid)].append(uid)
+        rows = {}
+        for cal_uid in self._calendars:
+            for row in self._query_rows(cal_uid, uids=shown[cal_uid]):
+                rows[row.uid] = row
+
+        new_data = {}
+        outdated = []
+        for uid in self.data:
+            if uid not in rows:
+                continue
+            if self._data_versions.get(uid) == rows[uid].version:
+                new_data[uid] = self.data[uid]
+            else:
+                outdated.append(rows[uid])
+        for record, row in zip(load_todo_records([(row.uid, row.ical) for row in outdated]), outdated):
+            new_data[record.uid] = Todo.load_from_record(record)
+            self._data_versions[record.uid] = row.version
+        replaced = {row.uid for row in outdated}
+
+        def current_parent(uid):
+            parent_it = self.store.iter_parent(self.todo_uid_to_iter[uid])
+            return None if parent_it is None else self.store[parent_it][5]
+
+        # Rows that are removed or moved to another parent are taken out of the store along with their subtree.
+        detached = set()
+        for uid in self.todo_uid_to_iter:
+            if uid not in new_data or rows[uid].parent != current_parent(uid):
+                detached.add(uid)
+
+        def add_subtree(it):
+            for child_iter in self.iterate_children(it, load=False):
+                detached.add(self.store[child_iter][5])
+                add_subtree(child_iter)
+        for uid in list(detached):
+            add_subtree(self.todo_uid_to_iter[uid])
+
+        for uid in [uid for uid in detached if current_parent(uid) not in detached]:
+            self.store.remove(self.todo_uid_to_iter[uid])
+        for uid in detached:
+            del self.todo_uid_to_iter[uid]
+            new_data.pop(uid, None)
+            self._data_versions.pop(uid, None)
+            self._time_display_expiry.pop(uid, None)
+            self._unloaded_rows.discard(uid)
 
-            for vtodo in server.todolist[self._current_calendar]:
-                todo = Todo.load_from_vtodo(vtodo)
-                if todo.completed and int(settings.HIDE_COMPLETED):
-                    continue
-                self.data[str(vtodo['UID'])] = todo
+        self.data.clear()
+        self.data.update(new_data)
+
+        # Rows that lost all their children no longer need a placeholder.
+        for uid in [uid for uid in self._unloaded_rows if not rows[uid].has_children]:
+            self.load_children(self.todo_uid_to_iter[uid])
+
+        attached = []
+        # New children are added to the rows whose children were added already, the others get them when expanded.
+        loaded = defaultdict(list)
+        for uid in self.todo_uid_to_iter:
+            if uid not in self._unloaded_rows:
+                loaded[self.todo_calendar(uid)].append(uid)
+        for cal_uid, parents in loaded.items():
+            children = defaultdict(list)
+            for row in self._query_rows(cal_uid, related_to=parents):
+                if row.uid not in self.todo_uid_to_iter:
+                    children[row.parent].append(row)
+            for parent, parent_rows in children.items():
+                self._add_rows(self.todo_uid_to_iter[parent], cal_uid, parent_rows)
+                attached.extend(row.uid for row in parent_rows)
+
+        # New top-level todos are added if they rank among the rows that were already scrolled to, which is all of
+        # them for the calendars whose rows were all added.
+        for cal_uid in self._calendars:
+            if cal_uid in self._finished_calendars:
+                until = None
+            elif self._last_top_level is not None:
+                until = self._last_top_level
+            else:
+                continue
+            top_level = [
+                row for row in self._query_rows(cal_uid, top_level=True, until=until)
+                if row.uid not in self.todo_uid_to_iter
+            ]
+            attached.extend(self.store[it][5] for it in self._add_rows(None, cal_uid, top_level))
+
+        attached_set = set(attached)
+        for uid in replaced:
+            if uid not in attached_set and uid in self.todo_uid_to_iter:
+                self.update_todo_row(uid)
+
+        for uid in attached:
+            parent_it = self.store.iter_parent(self.todo_uid_to_iter[uid])
+            if parent_it is None:
+                self.update_tree_view_row_visibility(self.todo_uid_to_iter[uid])
+            elif self.store[parent_it][5] not in attached_set:
+                self.update_tree_view_row_visibility(parent_it)
+
+        return replaced | attached_set
+
+    def _add_rows(self, parent_it, cal_uid, rows):
+        # Adds rows for the TodoRows read from the calendar, only these todos are parsed.
+        added = []
+        for record, row in zip(load_todo_records([(row.uid, row.ical) for row in rows]), rows):
+            uid = record.uid
+            self.data[uid] = Todo.load_from_record(record)
+            self._data_versions[uid] = row.version
+            self._todo_calendars[uid] = cal_uid
+            it = self.todo_uid_to_iter[uid] = self.attach_todo(parent_it, uid)
+            if row.has_children:
+                self.store.append(it, self.PLACEHOLDER_ROW)
+                self._unloaded_rows.add(uid)
+            added.append(it)
+        return added
+
+    def load_children(self, it):
+        uid = self.store[it][5]
+        if uid not in self._unloaded_rows:
+            return
+        self._unloaded_rows.discard(uid)
+        self.store.remove(self.store.iter_children(it))
+        cal_uid = self.todo_calendar(uid)
+        rows = self._query_rows(cal_uid, related_to=[uid])
+        self._add_rows(it, cal_uid, [row for row in rows if row.uid not in self.todo_uid_to_iter])
+
+    def has_more_rows(self):
+        return any(cal_uid not in self._finished_calendars for cal_uid in self._calendars)
+
+    def load_more_rows(self):
+        # The next page of each calendar is read, and the first PAGE_SIZE todos of all of them are added.
+        pages = {}
+        for cal_uid in self._calendars:
+            if cal_uid not in self._finished_calendars:
+                pages[cal_uid] = self._query_rows(
+                    cal_uid, top_level=True, after=self._cursors.get(cal_uid), order_by=LocalServer.LIST_ORDER,
+                    limit=self.PAGE_SIZE,
+                )
+        merged = heapq.merge(
+            *([(row.key, cal_uid, row) for row in rows] for cal_uid, rows in pages.items()),
+            key=lambda item: item[0], reverse=True,
+        )
+        added = defaultdict(list)
+        for key, cal_uid, row in itertools.islice(merged, self.PAGE_SIZE):
+            self._cursors[cal_uid] = self._last_top_level = key
+            added[cal_uid].append(row)
+        for cal_uid, rows in pages.items():
+            if len(rows) < self.PAGE_SIZE and len(added[cal_uid]) == len(rows):
+                self._finished_calendars.add(cal_uid)
+
+        for cal_uid, rows in added.items():
+            # Rows can be added early, by select_todo or when a sync adds them.
+            rows = [row for row in rows if row.uid not in self.todo_uid_to_iter]
+            for it in self._add_rows(None, cal_uid, rows):
+                self.update_tree_view_row_visibility(it)
+
+    def load_rows_on_scroll(self, adjustment):
+        # More rows are added when the end of the list is less than a screen away.
+        if self.has_more_rows() and (
+            adjustment.get_value() + 2 * adjustment.get_page_size() >= adjustment.get_upper()
+        ):
+            self.load_more_rows()
 
-            for todo in self.data.values():
-                parent = todo['related_to']
-                if parent not in self.data:
-                    parent = None
-                adjacency_list[parent].append(todo.uid)
+    def select_todo(self, uid):
+        # Adds the rows leading to the todo if they were not added yet. Todos that are not shown are ignored.
+        if uid not in self.todo_uid_to_iter:
+            if self._loaded_calendar is None:
+                return
+            for cal_uid in self._calendars:
+                parent = self._todo_parent(cal_uid, uid)
+                if parent is not False:
+                    break
+            else:
+                return
+            # From the first ancestor whose row was not added, down to the todo.
+            ancestors = [uid]
+            while parent is not None and parent not in self.todo_uid_to_iter:
+                ancestors.append(parent)
+                parent = self._todo_parent(cal_uid, parent)
+                if parent is False:
+                    return
+            ancestors.reverse()
+
+            if parent is None:
+                # Rows are sorted by the view, so a top-level todo can be added before the pages preceding it.
+                parent = ancestors.pop(0)
+                for it in self._add_rows(None, cal_uid, self._query_rows(cal_uid, uids=[parent])):
+                    self.update_tree_view_row_visibility(it)
+            for ancestor in ancestors:
+                if parent not in self.todo_uid_to_iter:
+                    return
+                self.load_children(self.todo_uid_to_iter[parent])
+                parent = ancestor
+            if uid not in self.todo_uid_to_iter:
+                return
 
-            def add_todos_to_store(current_todo=None):
-                for todo in adjacency_list[current_todo]:
-                    self.todo_uid_to_iter[todo] = self.attach_todo(self.todo_uid_to_iter.get(current_todo, None), todo)
-                    add_todos_to_store(todo)
-            add_todos_to_store()
+        path = self.sorted_store.convert_child_path_to_path(self.store.get_path(self.todo_uid_to_iter[uid]))
+        self.tree_view.expand_to_path(path)
+        self.tree_view.set_cursor(path, None, False)
 
-            for todo_uid in adjacency_list[None]:
-                self.update_tree_view_row_visibility(self.todo_uid_to_iter[todo_uid])
+    def _todo_row(self, uid):
+        _data = self.data[uid]
+        return [
+            _data.summary,
+            self.time_display(uid),
+            _data.completed,
+            _data.progress,
+            'applications-system-symbolic',
+            uid,
+            _data.sort_value,
+        ]
 
-            for todo in self.data.values():
-                self.connect_todo(todo)
+    def attach_todo(self, parent, uid):
+        return self.store.append(parent, self._todo_row(uid))
 
-        try:
-            self.tree_view.get_selection().select_iter(
-                self.sorted_store.convert_child_iter_to_iter(self.todo_uid_to_iter[_currently_selected_uid])[1],
-            )
-        except KeyError:
-            self.tree_selection_changed()
+    def update_todo_row(self, uid):
+        it = self.todo_uid_to_iter[uid]
+        for column, value in enumerate(self._todo_row(uid)):
+            self.store.set_value(it, column, value)
 
-    def attach_todo(self, parent, uid):
-        _data = self.data[uid]
-        return self.store.append(
-            parent,
-            [
-                _data.summary,
-                _data.time_display,
-                _data.completed,
-                _data.progress,
-                'applications-system-symbolic',
-                uid,
-                _data.sort_value,
-            ],
-        )
+    def todo_calendar(self, uid):
+        return self._todo_calendars.get(uid, self._loaded_calendar)
 
-    def new_todo(self, parent_uid=None, new_todo=None):
-        if self._current_calendar is None:
+    def new_todo(self, parent_uid=None, new_todo=None, calendar=None):
+        # Subtasks are added to the calendar of their parent. Smart lists have no calendar of their own.
+        if calendar is None:
+            calendar = self.todo_calendar(parent_uid) if parent_uid in self.data else self._current_calendar
+        if calendar is None or calendar in SMART_LISTS:
             return
 
         if new_todo is None:
             new_todo = Todo(related_to=parent_uid)
+        if self._current_calendar in SMART_LISTS:
+            self._todo_calendars[new_todo.uid] = calendar
 
         parent_it = self.todo_uid_to_iter.get(parent_uid, None)
+        if parent_it is not None:
+            self.load_children(parent_it)
         self.data[new_todo.uid] = new_todo
         todo_it = self.todo_uid_to_iter[new_todo.uid] = self.attach_todo(parent_it, new_todo.uid)
 
-        server.update_todo(new_todo.vtodo, self._current_calendar)
-        self.connect_todo(new_todo)
+        server.update_todo(new_todo.build_vtodo, calendar, uid=new_todo.uid)
 
         path = self.sorted_store.convert_child_path_to_path(self.store.get_path(todo_it))
         self.tree_view.expand_to_path(path)
@@ -762,28 +1138,38 @@ class TodoListWindow(Gtk.Grid):
             return
 
         cloned_todo = Todo.load_from_vtodo(icalendar.Todo.from_ical(data.vtodo.to_ical()), load_all=False)
-        self.new_todo(cloned_todo.related_to, new_todo=cloned_todo)
+        self.new_todo(cloned_todo.related_to, new_todo=cloned_todo, calendar=self.todo_calendar(attached_uid))
+
+    def connect_todo_signals(self):
+        # Connected once for all todos, changes to todos that are no longer shown are ignored.
+        def shown(callback):
+            def _callback(todo):
+                if self.data.get(todo.uid) is todo:
+                    callback(todo)
+            return _callback
 
-    def connect_todo(self, todo):
-        path = self.store.get_path(self.todo_uid_to_iter[todo.uid])
         for field in ('progress', 'status', 'summary'):
-            todo.connect(field, self.editor_view.set_data, todo)
-        todo.connect('progress', self.tree_view_update_progress, path)
-        todo.connect('progress', self.update_todo_completion, path)
-        todo.connect('status', self.update_todo_completion, path)
-        todo.connect('summary', self.tree_view_update_summary, path)
-        todo.connect('start_date', self.tree_view_update_date, path)
-        todo.connect('end_date', self.tree_view_update_date, path)
-        todo.connect('all_day', self.tree_view_update_date, path)
-        todo.connect('progress', self.tree_view_update_date, path)
-        todo.connect('status', self.tree_view_update_date, path)
-        todo.connect('progress', self.tree_view_update_sort, path)
-        todo.connect('status', self.tree_view_update_sort, path)
-        todo.connect('priority', self.tree_view_update_sort, path)
-        todo.connect('start_date', self.tree_view_update_sort, path)
-        todo.connect('end_date', self.tree_view_update_sort, path)
-        todo.connect('all_day', self.tree_view_update_sort, path)
-        todo.connect_to_all(server.update_todo, todo.vtodo, self._current_calendar)
+            Todo.signals.connect(field, shown(self.editor_view.set_data))
+        Todo.signals.connect('progress', shown(self.tree_view_update_progress))
+        Todo.signals.connect('progress', shown(self.tree_view_update_completion))
+        Todo.signals.connect('status', shown(self.tree_view_update_completion))
+        Todo.signals.connect('summary', shown(self.tree_view_update_summary))
+        Todo.signals.connect('start_date', shown(self.tree_view_update_date))
+        Todo.signals.connect('end_date', shown(self.tree_view_update_date))
+        Todo.signals.connect('all_day', shown(self.tree_view_update_date))
+        Todo.signals.connect('progress', shown(self.tree_view_update_date))
+        Todo.signals.connect('status', shown(self.tree_view_update_date))
+        Todo.signals.connect('progress', shown(self.tree_view_update_sort))
+        Todo.signals.connect('status', shown(self.tree_view_update_sort))
+        Todo.signals.connect('priority', shown(self.tree_view_update_sort))
+        Todo.signals.connect('start_date', shown(self.tree_view_update_sort))
+        Todo.signals.connect('end_date', shown(self.tree_view_update_sort))
+        Todo.signals.connect('all_day', shown(self.tree_view_update_sort))
+        Todo.signals.connect_to_all(shown(self.save_todo))
+
+    def save_todo(self, todo):
+        # The component is only built when the debounced save is written.
+        server.update_todo(todo.build_vtodo, self.todo_calendar(todo.uid), uid=todo.uid)
 
     def reset_action_popover(self, *args):
         self.popover.popdown()
@@ -797,18 +1183,25 @@ class TodoListWindow(Gtk.Grid):
         self._current_calendar = uid
         self.rebuild_todolist()
 
-    def iterate_children(self, it):
+    def iterate_children(self, it, load=True):
+        # Children that were not added yet are added first, unless load is False, in which case they are skipped.
+        if load:
+            self.load_children(it)
         child_iter = self.store.iter_children(it)
         while child_iter is not None:
-            yield child_iter
+            if self.store[child_iter][5]:
+                yield child_iter
             child_iter = self.store.iter_next(child_iter)
 
-    def update_todo_completion(self, path):
+    def update_todo_completion(self, row):
         # Implicit recursion through signals
-        value = self.store[path][2] = self.data[self.store[path][5]].completed
-        for child_iter in self.iterate_children(self.store.get_iter(path)):
+        value = self.store[row][2] = self.data[self.store[row][5]].completed
+        for child_iter in self.iterate_children(self.store[row].iter):
             self.store[child_iter][2] = self.data[self.store[child_iter][5]].completed = value
 
+    def tree_view_update_completion(self, todo):
+        self.update_todo_completion(self.todo_uid_to_iter[todo.uid])
+
     def todo_completion_toggle(self, widget, path):
         if isinstance(path, str):
             path = Gtk.TreePath.new_from_string(path)
@@ -829,7 +1222,8 @@ class TodoListWindow(Gtk.Grid):
             return
 
         path_iter = tree_selection.get_selected()[1]
-        if path_iter is None:
+        # Placeholder rows have no UID.
+        if path_iter is None or not self.sorted_store[path_iter][5]:
             self.editor_view.set_data(None)
             return
 
@@ -855,22 +1249,28 @@ class TodoListWindow(Gtk.Grid):
         _data = self.data[self.sorted_store[path][5]]
         _data.hide_subtasks = int(hide)
         self.update_tree_view_row_visibility(self.todo_uid_to_iter[_data.uid], not hide)
+        if not hide:
+            self.update_natural_dates()
+
+    def tree_view_update_summary(self, todo):
+        self.store[self.todo_uid_to_iter[todo.uid]][0] = todo.summary
 
-    def tree_view_update_summary(self, path):
-        _data = self.data[self.store[path][5]]
-        self.store[path][0] = _data.summary
+    def tree_view_update_date(self, todo):
+        self.store[self.todo_uid_to_iter[todo.uid]][1] = self.time_display(todo.uid)
 
-    def tree_view_update_date(self, path):
-        _data = self.data[self.store[path][5]]
-        self.store[path][1] = _data.time_display
+    def tree_view_update_progress(self, todo):
+        self.store[self.todo_uid_to_iter[todo.uid]][3] = todo.progress
 
-    def tree_view_update_progress(self, path):
-        _data = self.data[self.store[path][5]]
-        self.store[path][3] = _data.progress
+    def tree_view_update_sort(self, todo):
+        # Setting the same value would still make the sorted model move the row.
+        row = self.store[self.todo_uid_to_iter[todo.uid]]
+        sort_value = todo.sort_value
+        if row[6] != sort_value:
+            row[6] = sort_value
 
-    def tree_view_update_sort(self, path):
-        _data = self.data[self.store[path][5]]
-        self.store[path][6] = _data.sort_value
+    def tree_view_test_expand_row(self, tree_view, it, path):
+        self.load_children(self.sorted_store.convert_iter_to_child_iter(it))
+        return False
 
     def tree_view_row_activated(self, tree_view, path, column):
         if tree_view.row_expanded(path):
@@ -0,0 +1,131 @@
+# Cost of ordering the todo list. Compares the sort keys of Todo.sort_value, which only depend on the todo, with the
+# previous keys relative to the current time: both give the same order, but only the previous ones go stale. Also
+# times reading the list in order from the sort_value column of the local database.
+# Run from the repository root: python -m benchmarks.sort_values [TASK COUNT]
+import datetime
+import random
+import sys
+import tempfile
+import time
+
+import icalendar
+
+from abeluna.sync.local import LocalServer, load_todo_records
+from abeluna.sync.server import server
+from abeluna.windows.todolist import Todo, TodoListWindow
+
+DEFAULT_COUNT = 10000
+
+
+def time_relative_sort_value(todo, now):
+    # Todo.sort_value before the keys were made independent of the current time.
+    _GAP = 2**34
+    _MIN_BOUND = 0
+    _COMPLETED_BOUND = _GAP
+    _PRIORITY_BOUND = _GAP * 2
+    _END_DATE_BOUND = _GAP * 3
+
+    if todo.completed:
+        if todo.completed_date is None:
+            return _MIN_BOUND
+        return _COMPLETED_BOUND - int((now - todo.completed_date).total_seconds() // 60)
+    elif todo.status == 'CANCELLED':
+        return _COMPLETED_BOUND + 1
+    elif todo.status == 'IN-PROCESS':
+        return _PRIORITY_BOUND + 1
+    elif todo.end_date is not None:
+        return _END_DATE_BOUND - int((todo.end_date - now).total_seconds() // 60)
+    elif todo.priority:
+        return _PRIORITY_BOUND - todo.priority
+    return _COMPLETED_BOUND + 2
+
+
+def make_vtodos(count, now):
+    # Dates are whole minutes, which is the resolution of both keys. Todos are completed in the past, since the
+    # previous keys of todos completed in the future left their tier.
+    rng = random.Random(0)
+
+    def _date(latest=60 * 24 * 365):
+        return now + datetime.timedelta(minutes=rng.randint(-60 * 24 * 365, latest))
+
+    vtodos = []
+    for index in range(count):
+        vtodo = icalendar.Todo()
+        vtodo.add('UID', 'task-{}'.format(index))
+        vtodo.add('SUMMARY', 'Task {}'.format(index))
+        status = rng.choice(['NEEDS-ACTION', 'NEEDS-ACTION', 'IN-PROCESS', 'CANCELLED', 'COMPLETED'])
+        vtodo.add('STATUS', status)
+        if status == 'COMPLETED':
+            vtodo.add('PERCENT-COMPLETE', 100)
+            if rng.random() < 0.9:
+                vtodo.add('COMPLETED', _date(latest=0))
+        if rng.random() < 0.6:
+            vtodo.add('DUE', _date())
+        if rng.random() < 0.5:
+            vtodo.add('PRIORITY', rng.randint(1, 9))
+        vtodos.append(vtodo)
+    return vtodos
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def weak_order(todos, key):
+    # The todos grouped by equal keys, in descending order of the keys.
+    groups = {}
+    for todo in todos:
+        groups.setdefault(key(todo), set()).add(todo.uid)
+    return [groups[value] for value in sorted(groups, reverse=True)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COUNT
+    # Nothing is synchronized, so the background threads are stopped.
+    server.stop_all()
+    now = datetime.datetime(2024, 6, 1, 12, 0, tzinfo=datetime.timezone.utc)
+    vtodos = make_vtodos(count, now)
+    records = load_todo_records([(str(vtodo['UID']), vtodo.to_ical().decode()) for vtodo in vtodos])
+    todos = [Todo.load_from_record(record) for record in records]
+
+    keys, key_time = timed(lambda: [todo.sort_value for todo in todos])
+    old_keys, old_key_time = timed(lambda: [time_relative_sort_value(todo, now) for todo in todos])
+    _, sort_time = timed(lambda: sorted(keys, reverse=True))
+    later = now + datetime.timedelta(hours=1)
+    stale = sum(
+        time_relative_sort_value(todo, now) != time_relative_sort_value(todo, later) for todo in todos
+    )
+    same_order = weak_order(todos, lambda todo: todo.sort_value) == weak_order(
+        todos, lambda todo: time_relative_sort_value(todo, now),
+    )
+
+    local_server = LocalServer(tempfile.mkdtemp(), 'benchmark')
+    with local_server.batch() as batch:
+        for vtodo in vtodos:
+            batch.update_todo_from_server(vtodo)
+    _, page_time = timed(lambda: local_server.query_todos(
+        columns=TodoListWindow.ROW_COLUMNS, top_level=True, order_by=LocalServer.LIST_ORDER,
+        limit=TodoListWindow.PAGE_SIZE,
+    ))
+    rows, all_rows_time = timed(lambda: local_server.query_todos(
+        columns=('uid', 'sort_value'), order_by=LocalServer.LIST_ORDER,
+    ))
+    stored = {todo.uid: todo.sort_value for todo in todos}
+    stored_matches = all(sort_value == stored[uid] for uid, sort_value in rows)
+    LocalServer.close_connections(local_server.db_path)
+
+    print('{} todos'.format(count))
+    print('  same order as the time-relative keys:      {}'.format(same_order))
+    print('  stored keys match Todo.sort_value:         {}'.format(stored_matches))
+    print('  time-relative keys changed after an hour:  {}'.format(stale))
+    print('  computing the keys:                        {:.1f} ms'.format(key_time * 1000))
+    print('  computing the time-relative keys:          {:.1f} ms'.format(old_key_time * 1000))
+    print('  sorting the keys:                          {:.1f} ms'.format(sort_time * 1000))
+    print('  reading the first page of rows in order:   {:.1f} ms'.format(page_time * 1000))
+    print('  reading all the keys in order:             {:.1f} ms'.format(all_rows_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
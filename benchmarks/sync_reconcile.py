@@ -0,0 +1,114 @@
+# Time of a synchronization pass of one calendar against the number of tasks, with an in-memory CalDAV calendar, so
+# only the reconciliation and the local database are measured.
+# Run from the repository root: python -m benchmarks.sync_reconcile [TASK COUNT ...]
+import sys
+import tempfile
+import time
+
+import icalendar
+
+from abeluna.settings import settings
+from abeluna.sync.local import LocalServer
+from abeluna.sync.server import server
+
+DEFAULT_COUNTS = (1000, 10000, 50000)
+# Share of the tasks that are changed before the passes that merge changes.
+CHANGED_SHARE = 0.1
+
+
+class FakeResource:
+    def __init__(self, url, data, etag):
+        self.url = url
+        self.data = data
+        self.etag = etag
+
+
+class FakeCalendar:
+    # What SynchronizationServer._synchronize_calendar uses of abeluna.sync.calendar.Calendar, for a full sync.
+    def __init__(self, local_server):
+        self.name = 'benchmark'
+        self.local_server = local_server
+        self.calendar = self
+        self.resources = {}
+        self._etag_counter = 0
+
+    def _next_etag(self):
+        self._etag_counter += 1
+        return '"{}"'.format(self._etag_counter)
+
+    def put(self, uid, summary):
+        vtodo = icalendar.Todo()
+        vtodo.add('UID', uid)
+        vtodo.add('SUMMARY', summary)
+        vtodo.add('PRIORITY', len(summary) % 10)
+        vcal = icalendar.Calendar()
+        vcal.add('VERSION', '2.0')
+        vcal.add('PRODID', '-//Abeluna//Benchmark//EN')
+        vcal.add_component(vtodo)
+        url = 'https://example.com/calendar/{}.ics'.format(uid)
+        self.resources[url] = FakeResource(url, vcal.to_ical().decode(), self._next_etag())
+
+    def todos(self, include_completed=False):
+        return [FakeResource(resource.url, resource.data, resource.etag) for resource in self.resources.values()]
+
+    def etag(self, remote_todo):
+        return remote_todo.etag
+
+    def save_todo(self, remote_todo, data, etag=None):
+        if etag is not None and self.resources[remote_todo.url].etag != etag:
+            return False
+        resource = self.resources[remote_todo.url] = FakeResource(remote_todo.url, data, self._next_etag())
+        return resource.etag
+
+    def delete_todo(self, remote_todo, etag=None):
+        self.resources.pop(remote_todo.url, None)
+        return True
+
+
+def timed(cal):
+    start = time.perf_counter()
+    server._synchronize_calendar(cal, deadline=server.timefunc() + 3600)
+    elapsed = time.perf_counter() - start
+    # Everything was synchronized.
+    assert not cal.local_server.local_changes()
+    assert len(cal.local_server.todos()) == len(cal.resources)
+    return elapsed
+
+
+def benchmark(count):
+    local_server = LocalServer(tempfile.mkdtemp(), 'benchmark')
+    cal = FakeCalendar(local_server)
+    for index in range(count):
+        cal.put('task-{}'.format(index), 'Task {}'.format(index))
+    changed = ['task-{}'.format(index) for index in range(0, count, int(1 / CHANGED_SHARE))]
+
+    results = {'initial': timed(cal), 'unchanged': timed(cal)}
+    for uid in changed:
+        cal.put(uid, 'Changed on the server')
+    results['server changes'] = timed(cal)
+    changed = set(changed)
+    for local_item in local_server.todos():
+        if local_item.uid in changed:
+            vtodo = local_item.local_vtodo
+            vtodo['SUMMARY'] = icalendar.vText('Changed locally')
+            local_server.update_todo_from_client(vtodo)
+    results['local changes'] = timed(cal)
+    LocalServer.close_connections(local_server.db_path)
+    return results
+
+
+def main():
+    counts = [int(count) for count in sys.argv[1:]] or DEFAULT_COUNTS
+    # Only the synchronization pass is measured, so the background threads are stopped.
+    server.stop_all()
+    settings.general = settings.general._replace(INCREMENTAL_SYNC=0)
+
+    print('{:>8}  {:>10}  {:>10}  {:>15}  {:>14}'.format(
+        'tasks', 'initial', 'unchanged', 'server changes', 'local changes',
+    ))
+    for count in counts:
+        print('{:>8}  {:>9.3f}s  {:>9.3f}s  {:>14.3f}s  {:>13.3f}s'.format(count, *benchmark(count).values()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# Memory taken by each task of the todo list, measured with tracemalloc: the decoded fields the rows are loaded from,
+# the Todo objects of the list model, and the VTODO components, which are only built once a task is edited or saved.
+# Run from the repository root: python -m benchmarks.todo_memory [TASK COUNT]
+import datetime
+import gc
+import sys
+import tracemalloc
+
+import icalendar
+
+from abeluna.sync.local import load_todo_records, parsed_todo_cache
+from abeluna.sync.server import server
+from abeluna.windows.todolist import Todo
+
+DEFAULT_COUNT = 20000
+
+
+def make_todos(count):
+    # (uid, ical) pairs with the properties most clients set.
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    todos = []
+    for index in range(count):
+        vtodo = icalendar.Todo()
+        vtodo.add('UID', 'task-{}'.format(index))
+        vtodo.add('SUMMARY', 'Task number {}'.format(index))
+        vtodo.add('DESCRIPTION', 'A description of task {} that is a little longer than its summary.'.format(index))
+        vtodo.add('STATUS', 'NEEDS-ACTION')
+        vtodo.add('PRIORITY', index % 10)
+        vtodo.add('CATEGORIES', ['work', 'home'][index % 2])
+        vtodo.add('DUE', start + datetime.timedelta(hours=index))
+        vtodo.add('CREATED', start)
+        vtodo.add('DTSTAMP', start)
+        vtodo.add('LAST-MODIFIED', start)
+        vtodo.add('SEQUENCE', 0)
+        todos.append((str(vtodo['UID']), vtodo.to_ical().decode()))
+    return todos
+
+
+def measure(function):
+    # Returns the result of the function and the memory it still holds afterwards.
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    result = function()
+    parsed_todo_cache.clear()
+    gc.collect()
+    return result, tracemalloc.get_traced_memory()[0] - before
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COUNT
+    # Nothing is synchronized, so the background threads are stopped.
+    server.stop_all()
+    todos = make_todos(count)
+
+    tracemalloc.start()
+    records, fields_size = measure(lambda: load_todo_records(todos))
+    loaded, todo_size = measure(lambda: [Todo.load_from_record(record) for record in records])
+    _, vtodo_size = measure(lambda: [todo.build_vtodo() for todo in loaded])
+    tracemalloc.stop()
+
+    print('{} tasks, bytes per task:'.format(count))
+    for name, size in (
+        ('decoded fields (TodoRecord)', fields_size),
+        ('Todo', todo_size),
+        ('list model (both of the above)', fields_size + todo_size),
+        ('VTODO component, once built', vtodo_size),
+    ):
+        print('  {:<32} {:>8.0f}'.format(name, size / count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import datetime
+import unittest
+
+from abeluna.sync.server import parse_todo, split_calendar
+
+CUSTOM_TIMEZONE_CALENDAR = '''BEGIN:VCALENDAR\r
+VERSION:2.0\r
+PRODID:-//Test//EN\r
+BEGIN:VTIMEZONE\r
+TZID:Customized Time Zone\r
+BEGIN:STANDARD\r
+DTSTART:16010101T020000\r
+TZOFFSETFROM:-0400\r
+TZOFFSETTO:-0500\r
+RRULE:FREQ=YEARLY;BYMONTH=11;BYDAY=1SU\r
+END:STANDARD\r
+BEGIN:DAYLIGHT\r
+DTSTART:16010101T020000\r
+TZOFFSETFROM:-0500\r
+TZOFFSETTO:-0400\r
+RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=2SU\r
+END:DAYLIGHT\r
+END:VTIMEZONE\r
+BEGIN:VTODO\r
+UID:custom-timezone-todo\r
+SUMMARY:Due in a timezone defined by the calendar object\r
+DUE;TZID=Customized Time Zone:20240115T100000\r
+END:VTODO\r
+END:VCALENDAR\r
+'''
+
+
+class SplitCalendarTest(unittest.TestCase):
+    def test_pieces_join_back(self):
+        pieces = split_calendar(CUSTOM_TIMEZONE_CALENDAR)
+        self.assertEqual([name for name, _ in pieces], [None, 'VTIMEZONE', 'VTODO', None])
+        self.assertEqual(''.join(text for _, text in pieces), CUSTOM_TIMEZONE_CALENDAR)
+
+    def test_unbalanced(self):
+        with self.assertRaises(ValueError):
+            split_calendar('BEGIN:VCALENDAR\r\nEND:VTODO\r\nEND:VCALENDAR\r\n')
+
+
+class ParseTodoTest(unittest.TestCase):
+    def test_custom_tzid(self):
+        # The TZID is not an Olson name, it is only defined by the VTIMEZONE of the calendar object.
+        pieces = split_calendar(CUSTOM_TIMEZONE_CALENDAR)
+        vtimezones = [text for name, text in pieces if name == 'VTIMEZONE']
+        vtodo = parse_todo(next(text for name, text in pieces if name == 'VTODO'), vtimezones)
+        due = vtodo['DUE'].dt
+        self.assertIsNotNone(due.tzinfo)
+        self.assertEqual(due, datetime.datetime(2024, 1, 15, 15, 0, tzinfo=datetime.timezone.utc))
+        self.assertEqual(str(vtodo['UID']), 'custom-timezone-todo')
+
+    def test_without_tzid(self):
+        vtodo = parse_todo('BEGIN:VTODO\r\nUID:a\r\nDUE;VALUE=DATE:20240115\r\nEND:VTODO\r\n')
+        self.assertEqual(vtodo['DUE'].dt, datetime.date(2024, 1, 15))
+
+
+if __name__ == '__main__':
+    unittest.main()